@@ -74,11 +74,23 @@ class SimViz():
         
     def plot_var(self,
                  var,
+                 nbins=None,
                  **kwargs):
 
-        fig = px.histogram(getattr(self.sim, var),
-                           **self.plot_config,
-                           **kwargs)
+        if nbins is not None:
+            plot_data = pd.DataFrame({var: np.ravel(getattr(self.sim, var))})
+
+            fig = px.bar(binned_counts(plot_data, var, [], nbins),
+                         x=var,
+                         y='count',
+                         **self.plot_config,
+                         **kwargs)
+
+            fig.update_layout(bargap=0)
+        else:
+            fig = px.histogram(getattr(self.sim, var),
+                               **self.plot_config,
+                               **kwargs)
 
         fig.update_layout(showlegend=False,
                             xaxis_title=var)
@@ -89,6 +101,7 @@ class SimViz():
                      facet_col=None,
                      facet_col_wrap=5,
                      facets_limit=None,
+                     nbins=None,
                      **kwargs):
 
         plot_data = self.sim.ratings_rankings_df
@@ -96,6 +109,24 @@ class SimViz():
         if facets_limit is not None:
             plot_data = plot_data[plot_data[facets_limit['var']] < facets_limit['records']]
 
+        if nbins is not None:
+            # counts are binned here so the figure holds nbins bars per facet
+            # and colour rather than every rating
+            kwargs.pop('marginal', None)
+            group_cols = [col for col in [facet_col, kwargs.get('color')] if col is not None]
+
+            fig = px.bar(binned_counts(plot_data, 'rating', group_cols, nbins),
+                         x='rating',
+                         y='count',
+                         facet_col=facet_col,
+                         facet_col_wrap=facet_col_wrap,
+                         **self.plot_config,
+                         **kwargs)
+
+            fig.update_layout(bargap=0)
+
+            return fig
+
         fig = px.histogram(plot_data,
                             x='rating',
                             facet_col=facet_col,
@@ -106,8 +137,12 @@ class SimViz():
         return fig
 
     def plot_ratings_rankings(self,
+                                facet_col='auto',
                                 facet_col_wrap=5,
                                 facets_limit=None,
+                                max_points_per_facet=None,
+                                density_bins=None,
+                                seed=None,
                                 **kwargs):
 
         plot_data = self.sim.ratings_rankings_df
@@ -115,15 +150,92 @@ class SimViz():
         if facets_limit is not None:
             plot_data = plot_data[plot_data[facets_limit['var']] < facets_limit['records']]
 
+        # a facet per person makes the figure grow with n_people, so the
+        # bounded modes pool everyone unless a facet column is asked for
+        if facet_col == 'auto':
+            facet_col = None if density_bins is not None or max_points_per_facet is not None else 'person'
+
+        if density_bins is not None:
+            # one marker per (rank, rating bin) cell, sized by the number of points
+            group_cols = [col for col in [facet_col, 'rank'] if col is not None]
+            plot_data = binned_counts(plot_data, 'rating', group_cols, density_bins)
+
+            fig = px.scatter(plot_data,
+                                x='rank',
+                                y='rating',
+                                size='count',
+                                facet_col=facet_col,
+                                facet_col_wrap=facet_col_wrap,
+                                **self.plot_config,
+                                **kwargs)
+
+            fig.update_layout(showlegend=False)
+
+            return fig
+
+        if max_points_per_facet is not None:
+            plot_data = downsample_facets(plot_data, facet_col, max_points_per_facet, seed=seed)
+
         fig = px.scatter(plot_data,
                             x='rank',
                             y='rating',
                             color='choc',
-                            facet_col='person',
+                            facet_col=facet_col,
                             facet_col_wrap=facet_col_wrap,
                             **self.plot_config,
                             **kwargs)
         
         fig.update_layout(showlegend=False)
 
-        return fig
\ No newline at end of file
+        return fig
+
+
+def binned_counts(plot_data,
+                  value_col,
+                  group_cols,
+                  nbins):
+
+    # histogram counts per group computed in one bincount, returned with the
+    # bin centres in value_col
+    values = plot_data[value_col].to_numpy(dtype=np.float64)
+    if len(values) == 0:
+        return pd.DataFrame(columns=list(group_cols) + [value_col, 'count'])
+
+    edges = np.linspace(values.min(), values.max(), nbins + 1)
+    bins = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, nbins - 1)
+
+    if group_cols:
+        group_codes, groups = pd.MultiIndex.from_frame(plot_data[group_cols]).factorize()
+    else:
+        group_codes, groups = np.zeros(len(values), dtype=np.int64), None
+
+    n_groups = group_codes.max() + 1
+    counts = np.bincount(group_codes * nbins + bins, minlength=n_groups * nbins).reshape(n_groups, nbins)
+
+    group_idx, bin_idx = np.nonzero(counts)
+
+    binned = pd.DataFrame({value_col: ((edges[:-1] + edges[1:]) / 2)[bin_idx],
+                           'count': counts[group_idx, bin_idx]})
+
+    for i, col in enumerate(group_cols):
+        binned.insert(i, col, groups.get_level_values(i)[group_idx])
+
+    return binned
+
+
+def downsample_facets(plot_data,
+                      facet_col,
+                      max_points,
+                      seed=None):
+
+    # keep at most max_points randomly chosen rows from every facet
+    rng = np.random.default_rng(seed)
+    if facet_col is None:
+        codes = np.zeros(len(plot_data), dtype=np.int64)
+    else:
+        codes = pd.factorize(plot_data[facet_col])[0]
+
+    order = np.lexsort((rng.random(len(codes)), codes))
+    position = np.arange(len(codes)) - np.searchsorted(codes[order], codes[order])
+
+    return plot_data.iloc[np.sort(order[position < max_points])]
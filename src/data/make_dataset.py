@@ -1,17 +1,23 @@
 # -*- coding: utf-8 -*-
 import click
 import logging
-from pathlib import Path
 
 import os
 import git
+import json
+import numpy as np
 import pandas as pd
 from sklearn.preprocessing import LabelEncoder
 import pickle
 
+from src.features.build_features import RankingIndex
+
 
 git_root = git.Repo(search_parent_directories=True).git.rev_parse("--show-toplevel")
 
+segments_path = os.path.join(git_root, 'data', 'external', 'segments.csv')
+quarantine_path = os.path.join(git_root, 'data', 'interim', 'quarantine.jsonl')
+
 def read_ranking(file,
                  input_data_dir=os.path.join(git_root,'data','external')):
 
@@ -20,118 +26,113 @@ def read_ranking(file,
 
     return ranking
 
-def read_files():
-
-    files = [f for f in os.listdir(os.path.join(git_root,'data','external')) if f.endswith('.txt')]
-
-    raw_data = {os.path.splitext(file)[0]: {'ranking': read_ranking(file)} for file in files}
-
-    return raw_data
-
-def raw_data_to_df(raw_data):
-
-    people = list(raw_data.keys())
-    people_le = LabelEncoder()
-    people_le.fit(people)
-    
-    chocs = raw_data[next(iter(raw_data))]['ranking']
-    choc_le = LabelEncoder()
-    choc_le.fit(chocs)
-
-    ranking_df = pd.DataFrame.from_dict(raw_data).melt(var_name='person',value_name='choc').explode('choc')
+def read_segments(segments_file=segments_path):
 
-    ranking_df['person_idx'] = people_le.transform(ranking_df['person'])
-    ranking_df['choc_idx'] = choc_le.transform(ranking_df['choc'])
+    # optional person -> segment lookup, one row per person with columns person,segment
+    if segments_file is None or not os.path.exists(segments_file):
+        return {}
 
-    ranking_df['rank'] = ranking_df.groupby('person').cumcount()
+    segments_df = pd.read_csv(segments_file, dtype=str)
 
-    return ranking_df
+    return dict(zip(segments_df['person'], segments_df['segment']))
 
-def read_processed_data():
-
-    with open(os.path.join(git_root, 'data','processed','ranking_df.pkl'), 'rb') as f:
-        ranking_df = pickle.load(f)
-
-    return ranking_df
-
-import os
-import git
-import pandas as pd
-from sklearn.preprocessing import LabelEncoder
-import pickle
-
-
-git_root = git.Repo(search_parent_directories=True).git.rev_parse("--show-toplevel")
-
-def read_ranking(file,
-                 input_data_dir=os.path.join(git_root,'data','external')):
-
-    with open(os.path.join(input_data_dir,file), 'r') as f:
-        ranking = [line.strip() for line in f.readlines()]
-
-    return ranking
-
-def read_files():
+def read_files(segments_file=segments_path):
 
     files = [f for f in os.listdir(os.path.join(git_root,'data','external')) if f.endswith('.txt')]
 
     raw_data = {os.path.splitext(file)[0]: {'ranking': read_ranking(file)} for file in files}
 
-    return raw_data
-
-def raw_data_to_df(raw_data):
-
-    people = list(raw_data.keys())
-    people_le = LabelEncoder()
-    people_le.fit(people)
-    
-    chocs = raw_data[next(iter(raw_data))]['ranking']
-    choc_le = LabelEncoder()
-    choc_le.fit(chocs)
-
-    ranking_df = pd.DataFrame.from_dict(raw_data).melt(var_name='person',value_name='choc').explode('choc')
-
-    ranking_df['person_idx'] = people_le.transform(ranking_df['person'])
-    ranking_df['choc_idx'] = choc_le.transform(ranking_df['choc'])
-
-    ranking_df['rank'] = ranking_df.groupby('person').cumcount()
+    for person, segment in read_segments(segments_file).items():
+        if person in raw_data:
+            raw_data[person]['segment'] = segment
 
-    return ranking_df
-
-def read_processed_data():
-
-    with open(os.path.join(git_root, 'data','processed','ranking_df.pkl'), 'rb') as f:
-        ranking_df = pickle.load(f)
-
-    return ranking_df
-
-import os
-import git
-import pandas as pd
-from sklearn.preprocessing import LabelEncoder
-import pickle
-
-
-git_root = git.Repo(search_parent_directories=True).git.rev_parse("--show-toplevel")
-
-def read_ranking(file,
-                 input_data_dir=os.path.join(git_root,'data','external')):
-
-    with open(os.path.join(input_data_dir,file), 'r') as f:
-        ranking = [line.strip() for line in f.readlines()]
-
-    return ranking
-
-def read_files():
+    return raw_data
 
-    files = [f for f in os.listdir(os.path.join(git_root,'data','external')) if f.endswith('.txt')]
+def validate_rankings(raw_data,
+                      chocs=None):
 
-    raw_data = {os.path.splitext(file)[0]: {'ranking': read_ranking(file)} for file in files}
+    # every ranking is checked at once on flat arrays of (person, item); people
+    # with unknown, duplicate or missing items, no items at all or a name that
+    # repeats another person's are quarantined, blank lines are dropped
+    if not raw_data:
+        return {}, []
 
-    return raw_data
+    people = list(raw_data.keys())
+    lengths = np.array([len(raw_data[person]['ranking']) for person in people], dtype=int)
+    person_codes = np.repeat(np.arange(len(people)), lengths)
+    items = np.array([item for person in people for item in raw_data[person]['ranking']], dtype=object)
+
+    blank = items == ''
+    n_blank = np.bincount(person_codes[blank], minlength=len(people))
+
+    # items are hashed rather than sorted, string comparisons dominate otherwise
+    person_codes = person_codes[~blank]
+    item_codes, item_values = pd.factorize(items[~blank])
+    item_values = np.asarray(item_values, dtype=str)
+
+    # distinct (person, item) pairs, with how often each was listed
+    n_items = max(len(item_values), 1)
+    pair_values, pair_counts = np.unique(person_codes * n_items + item_codes, return_counts=True)
+    pair_people, pair_items = np.divmod(pair_values, n_items)
+
+    if chocs is None:
+        # the reference list is every item at least half of the people ranked
+        listed_by = np.bincount(pair_items, minlength=len(item_values))
+        chocs = item_values[listed_by * 2 >= len(people)]
+    chocs = np.sort(np.asarray(chocs, dtype=str))
+
+    known = np.isin(item_values, chocs)
+    unknown = ~known[pair_items]
+    duplicate = pair_counts > 1
+    n_known = np.bincount(pair_people[~unknown], minlength=len(people))
+
+    names = pd.Series(people).str.strip().str.lower()
+    repeated_name = names.duplicated().to_numpy()
+
+    bad = (np.bincount(pair_people[unknown], minlength=len(people)) > 0) | \
+          (np.bincount(pair_people[duplicate], minlength=len(people)) > 0) | \
+          (n_known < len(chocs)) | \
+          (lengths - n_blank == 0) | \
+          repeated_name
+
+    # reasons are only spelled out for the people quarantined, whose pairs
+    # are contiguous since np.unique sorts them by person
+    quarantined = []
+    for p in np.flatnonzero(bad):
+        pairs = slice(*np.searchsorted(pair_people, [p, p + 1]))
+        listed = pair_items[pairs]
+        reasons = {'unknown': item_values[listed[~known[listed]]].tolist(),
+                   'duplicate': item_values[listed[duplicate[pairs]]].tolist(),
+                   'missing': np.setdiff1d(chocs, item_values[listed]).tolist(),
+                   'blank_lines': int(n_blank[p]),
+                   'empty': bool(lengths[p] == n_blank[p]),
+                   'duplicate_respondent': bool(repeated_name[p])}
+        quarantined.append({'person': people[p],
+                            'reasons': {reason: value for reason, value in reasons.items() if value}})
+
+    valid = {people[p]: raw_data[people[p]] for p in np.flatnonzero(~bad)}
+    for p in np.flatnonzero(~bad & (n_blank > 0)):
+        valid[people[p]] = dict(raw_data[people[p]],
+                                ranking=[item for item in raw_data[people[p]]['ranking'] if item != ''])
+
+    return valid, quarantined
+
+def write_quarantine(quarantined,
+                     path=quarantine_path):
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        for record in quarantined:
+            f.write(json.dumps(record) + '\n')
+
+    return path
 
 def raw_data_to_df(raw_data):
 
+    # e.g. every ranking was quarantined
+    if not raw_data:
+        raise ValueError('no valid rankings to build a ranking_df from')
+
     people = list(raw_data.keys())
     people_le = LabelEncoder()
     people_le.fit(people)
@@ -140,13 +141,25 @@ def raw_data_to_df(raw_data):
     choc_le = LabelEncoder()
     choc_le.fit(chocs)
 
-    ranking_df = pd.DataFrame.from_dict(raw_data).melt(var_name='person',value_name='choc').explode('choc')
+    rankings = {person: {'ranking': data['ranking']} for person, data in raw_data.items()}
+    ranking_df = pd.DataFrame.from_dict(rankings).melt(var_name='person',value_name='choc').explode('choc')
 
     ranking_df['person_idx'] = people_le.transform(ranking_df['person'])
     ranking_df['choc_idx'] = choc_le.transform(ranking_df['choc'])
 
     ranking_df['rank'] = ranking_df.groupby('person').cumcount()
 
+    # segment columns are only added when segments were read, people without one are left missing
+    segments = {person: data['segment'] for person, data in raw_data.items() if 'segment' in data}
+    if segments:
+        ranking_df['segment'] = ranking_df['person'].map(segments)
+
+        segment_le = LabelEncoder()
+        segment_le.fit(sorted(set(segments.values())))
+        ranking_df['segment_idx'] = -1
+        has_segment = ranking_df['segment'].notna()
+        ranking_df.loc[has_segment, 'segment_idx'] = segment_le.transform(ranking_df.loc[has_segment, 'segment'])
+
     return ranking_df
 
 def read_processed_data():
@@ -167,22 +180,21 @@ def main(input_filepath, output_filepath):
     logger = logging.getLogger(__name__)
     logger.info('making final data set from raw data')
 
-    raw_data = read_files()
+    raw_data, quarantined = validate_rankings(read_files())
+    write_quarantine(quarantined)
+    if quarantined:
+        logger.warning('{n} rankings quarantined to {path}'.format(n=len(quarantined), path=quarantine_path))
+
     ranking_df = raw_data_to_df(raw_data)
 
     with open(os.path.join(git_root, 'data','processed','ranking_df.pkl'), 'wb') as f:
         pickle.dump(ranking_df, f)
 
+    RankingIndex.from_ranking_df(ranking_df).save()
+
 
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     logging.basicConfig(level=logging.INFO, format=log_fmt)
 
-    # not used in this stub but often useful for finding various files
-    project_dir = Path(__file__).resolve().parents[2]
-
-    # find .env automagically by walking up directories until it's found, then
-    # load up the .env entries as environment variables
-    load_dotenv(find_dotenv())
-
     main()
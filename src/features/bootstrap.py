@@ -0,0 +1,112 @@
+import numpy as np
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from src.features.build_features import ranking_df_codes, rankings_to_long
+
+
+# per-person statistics shared with the worker processes through the pool
+# initializer, so they are pickled once per worker rather than once per chunk
+_person_stats = None
+
+
+def person_stats(rankings,
+                 n):
+
+    # columns are, per chocolate: rank sum, times ranked, top n and bottom n
+    # indicators; every bootstrap statistic is a weighted sum of these rows
+    if hasattr(rankings, 'columns'):
+        person_codes, choc_codes, ranks, chocs = ranking_df_codes(rankings)
+    else:
+        rankings = np.asarray(rankings)
+        person_codes, choc_codes, ranks = rankings_to_long(rankings)
+        chocs = np.arange(rankings.shape[1])
+
+    n_people = int(person_codes.max()) + 1
+    n_chocs = len(chocs)
+    max_rank = int(ranks.max())
+
+    cells = person_codes * n_chocs + choc_codes
+    columns = [ranks, np.ones_like(ranks), ranks < n, ranks >= max_rank - n]
+
+    stats = np.stack([np.bincount(cells, weights=column, minlength=n_people * n_chocs)
+                      for column in columns], axis=1)
+
+    return stats.reshape(n_people, n_chocs * len(columns)).astype(np.float32), chocs
+
+
+def _init_worker(stats):
+
+    global _person_stats
+    _person_stats = stats
+
+
+def _bootstrap_chunk(seed_seq,
+                     n_boot):
+
+    n_people = _person_stats.shape[0]
+    rng = np.random.default_rng(seed_seq)
+
+    # resampling respondents with replacement is a multinomial count per
+    # person, so each replicate is one row of a matrix product
+    weights = rng.multinomial(n_people, np.full(n_people, 1 / n_people), size=n_boot)
+
+    return weights.astype(np.float32) @ _person_stats
+
+
+def bootstrap_replicates(stats,
+                         n_boot=1000,
+                         chunk_size=50,
+                         n_workers=None,
+                         seed=0):
+
+    chunks = [min(chunk_size, n_boot - start) for start in range(0, n_boot, chunk_size)]
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(chunks))
+
+    with ProcessPoolExecutor(max_workers=n_workers or os.cpu_count(),
+                             initializer=_init_worker,
+                             initargs=(stats,)) as pool:
+        return np.concatenate(list(pool.map(_bootstrap_chunk, seed_seqs, chunks)))
+
+
+def _interval(estimate,
+              replicates,
+              alpha):
+
+    lower, upper = np.nanquantile(replicates, [alpha / 2, 1 - alpha / 2], axis=0)
+
+    return {'estimate': estimate,
+            'lower': lower,
+            'upper': upper}
+
+
+def bootstrap_rank_stats(rankings,
+                         n=5,
+                         n_boot=1000,
+                         alpha=0.05,
+                         chunk_size=50,
+                         n_workers=None,
+                         seed=0):
+
+    # percentile intervals for the mean rank and top / bottom n frequencies of
+    # every chocolate, in the same chocolate order as RankingIndex
+    stats, chocs = person_stats(rankings, n)
+    n_chocs = len(chocs)
+
+    replicates = bootstrap_replicates(stats,
+                                      n_boot=n_boot,
+                                      chunk_size=chunk_size,
+                                      n_workers=n_workers,
+                                      seed=seed)
+    replicates = replicates.reshape(n_boot, n_chocs, 4)
+    observed = stats.sum(axis=0).reshape(n_chocs, 4)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_rank = replicates[:, :, 0] / replicates[:, :, 1]
+
+    return {'chocs': chocs,
+            'n': n,
+            'mean_rank': _interval(observed[:, 0] / observed[:, 1], mean_rank, alpha),
+            'top_n': _interval(observed[:, 2], replicates[:, :, 2], alpha),
+            'bottom_n': _interval(observed[:, 3], replicates[:, :, 3], alpha)}
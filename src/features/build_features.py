@@ -0,0 +1,276 @@
+import numpy as np
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import git
+git_root = git.Repo(search_parent_directories=True).git.rev_parse("--show-toplevel")
+
+ranking_index_path = os.path.join(git_root, 'data', 'processed', 'ranking_index.npz')
+
+
+def thread_pool(n_jobs=None):
+
+    # numpy and scipy release the GIL inside their array kernels, so threads
+    # use every core while sharing the inputs rather than copying them to processes
+    return ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count())
+
+
+def ranking_df_codes(ranking_df,
+                     chocs=None):
+
+    # works for both read_files() data and SimGenerative.ratings_rankings_df,
+    # chocolates are coded in sorted order as the LabelEncoder in make_dataset does
+    if chocs is None:
+        chocs = np.sort(ranking_df['choc'].unique())
+
+    chocs = np.array(list(chocs))
+    choc_values = np.array(ranking_df['choc'].tolist())
+
+    choc_codes = np.minimum(np.searchsorted(chocs, choc_values), len(chocs) - 1)
+    if np.any(chocs[choc_codes] != choc_values):
+        raise ValueError('ranking_df contains chocolates not in the index')
+
+    person_codes = np.unique(ranking_df['person'].to_numpy(), return_inverse=True)[1]
+
+    return person_codes, choc_codes, ranking_df['rank'].to_numpy(dtype=np.int64), chocs
+
+
+def rankings_to_long(choc_rankings_array):
+
+    # choc_rankings_array lists chocolates best first, one row per person
+    n_people, n_chocs = choc_rankings_array.shape
+
+    return (np.repeat(np.arange(n_people), n_chocs),
+            choc_rankings_array.ravel(),
+            np.tile(np.arange(n_chocs), n_people))
+
+
+def long_to_positions(person_codes,
+                      choc_codes,
+                      ranks,
+                      n_chocs):
+
+    # rank of every chocolate for each person, the first mention wins if a
+    # chocolate is repeated and missing chocolates are left at n_chocs
+    positions = np.full((person_codes.max() + 1, n_chocs), n_chocs)
+    np.minimum.at(positions, (person_codes, choc_codes), ranks)
+
+    return positions
+
+
+def positions_dtype(n_chocs):
+
+    # smallest integer type holding n_chocs, the position of unranked chocolates
+    return np.min_scalar_type(n_chocs)
+
+
+def matrix_to_positions(choc_rankings_array,
+                        n_chocs):
+
+    # the inverse of every row's ordering, without the long arrays; rows
+    # repeating a chocolate go through long_to_positions so the first
+    # mention still wins
+    n_people, n_ranked = choc_rankings_array.shape
+    dtype = positions_dtype(n_chocs)
+
+    positions = np.full((n_people, n_chocs), n_chocs, dtype=dtype)
+    ranks = np.broadcast_to(np.arange(n_ranked, dtype=dtype), choc_rankings_array.shape)
+    np.put_along_axis(positions, choc_rankings_array, ranks, axis=1)
+
+    repeated = np.flatnonzero((np.take_along_axis(positions, choc_rankings_array, axis=1) != ranks).any(axis=1))
+    if len(repeated):
+        positions[repeated] = long_to_positions(*rankings_to_long(choc_rankings_array[repeated]), n_chocs)
+
+    return positions
+
+
+def pairwise_wins(positions,
+                  n_chocs,
+                  max_block_elements=2 ** 22,
+                  n_jobs=None):
+
+    # wins[i, j] counts the people ranking i above j, compared[i, j] the
+    # people who ranked both; blocks of people are compared in their smallest
+    # integer type and summed in uint16, which bounds the block size
+    positions = positions.astype(positions_dtype(n_chocs), copy=False)
+    n_people = positions.shape[0]
+    block_size = max(1, min(max_block_elements // (n_chocs * n_chocs), 2 ** 16 - 1))
+
+    def count(people):
+        wins = np.zeros(n_chocs * n_chocs, dtype=np.int64)
+        compared = np.zeros((n_chocs, n_chocs), dtype=np.int64)
+
+        for start in range(people.start, people.stop, block_size):
+            block = positions[start:min(start + block_size, people.stop)]
+            ranked = block < n_chocs
+
+            # an unranked j is moved to position 0 so nothing counts as beating it
+            beaten = block if ranked.all() else np.where(ranked, block, 0).astype(block.dtype)
+            above = (block[:, :, None] < beaten[:, None, :]).reshape(block.shape[0], -1)
+            wins += np.add.reduce(above.view(np.uint8), axis=0, dtype=np.uint16)
+
+            ranked = ranked.astype(np.float32)
+            compared += np.rint(ranked.T @ ranked).astype(np.int64)
+
+        return wins.reshape(n_chocs, n_chocs), compared
+
+    n_jobs = max(1, min(n_jobs or os.cpu_count(), -(-n_people // block_size)))
+    bounds = np.linspace(0, n_people, n_jobs + 1).astype(int)
+
+    with thread_pool(n_jobs) as pool:
+        counts = list(pool.map(count, [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]))
+
+    return sum(c[0] for c in counts), sum(c[1] for c in counts)
+
+
+class RankingIndex():
+
+    def __init__(self,
+                 chocs):
+
+        self.chocs = np.asarray(chocs)
+        self.n_chocs = len(self.chocs)
+        self.n_people = 0
+        self.max_rank = 0
+
+        # rank_hist[c, r] counts how often chocolate c was given rank r
+        self.rank_hist = np.zeros((self.n_chocs, self.n_chocs), dtype=np.int64)
+        self.rank_sums = np.zeros(self.n_chocs, dtype=np.int64)
+        self.wins = np.zeros((self.n_chocs, self.n_chocs), dtype=np.int64)
+        self.compared = np.zeros((self.n_chocs, self.n_chocs), dtype=np.int64)
+
+    @classmethod
+    def from_rankings(cls,
+                      choc_rankings_array,
+                      chocs=None):
+
+        choc_rankings_array = np.asarray(choc_rankings_array)
+        index = cls(np.arange(choc_rankings_array.shape[1]) if chocs is None else chocs)
+
+        return index.update(choc_rankings_array)
+
+    @classmethod
+    def from_ranking_df(cls,
+                        ranking_df):
+
+        person_codes, choc_codes, ranks, chocs = ranking_df_codes(ranking_df)
+
+        return cls(chocs).update_long(person_codes, choc_codes, ranks)
+
+    def update_long(self,
+                    person_codes,
+                    choc_codes,
+                    ranks):
+
+        # aggregates are plain counts, so new respondents are simply added
+        if ranks.max() >= self.n_chocs:
+            raise ValueError('ranks must be below the number of chocolates')
+
+        self.rank_hist += np.bincount(choc_codes * self.n_chocs + ranks,
+                                      minlength=self.n_chocs ** 2).reshape(self.n_chocs, self.n_chocs)
+        self.rank_sums += np.bincount(choc_codes, weights=ranks, minlength=self.n_chocs).astype(np.int64)
+        self.max_rank = max(self.max_rank, int(ranks.max()))
+
+        return self._update_pairs(long_to_positions(person_codes, choc_codes, ranks, self.n_chocs))
+
+    def update(self,
+               choc_rankings_array):
+
+        # a ranking matrix is counted directly, column by column for the
+        # rank histogram and in blocks of positions for the pairwise counts
+        choc_rankings_array = np.asarray(choc_rankings_array)
+        n_ranked = choc_rankings_array.shape[1]
+
+        if n_ranked > self.n_chocs or choc_rankings_array.min() < 0 or choc_rankings_array.max() >= self.n_chocs:
+            raise ValueError('rankings must be chocolate codes below the number of chocolates')
+
+        rank_hist = np.stack([np.bincount(choc_rankings_array[:, rank], minlength=self.n_chocs)
+                              for rank in range(n_ranked)], axis=1)
+
+        self.rank_hist[:, :n_ranked] += rank_hist
+        self.rank_sums += rank_hist @ np.arange(n_ranked)
+        self.max_rank = max(self.max_rank, n_ranked - 1)
+
+        return self._update_pairs(matrix_to_positions(choc_rankings_array, self.n_chocs))
+
+    def _update_pairs(self,
+                      positions):
+
+        wins, compared = pairwise_wins(positions, self.n_chocs)
+        self.wins += wins
+        self.compared += compared
+        self.n_people += positions.shape[0]
+
+        return self
+
+    def update_from_ranking_df(self,
+                               ranking_df):
+
+        return self.update_long(*ranking_df_codes(ranking_df, chocs=self.chocs)[:3])
+
+    @property
+    def counts(self):
+
+        return self.rank_hist.sum(axis=1)
+
+    @property
+    def mean_rank(self):
+
+        return self.rank_sums / self.counts
+
+    @property
+    def win_rates(self):
+
+        return self.wins / np.maximum(self.compared, 1)
+
+    def top_n(self,
+              n):
+
+        return self.rank_hist[:, :n].sum(axis=1)
+
+    def bottom_n(self,
+                 n):
+
+        return self.rank_hist[:, max(self.max_rank - n, 0):].sum(axis=1)
+
+    def save(self,
+             path=ranking_index_path):
+
+        np.savez(path,
+                 chocs=self.chocs,
+                 n_people=self.n_people,
+                 max_rank=self.max_rank,
+                 rank_hist=self.rank_hist,
+                 rank_sums=self.rank_sums,
+                 wins=self.wins,
+                 compared=self.compared)
+
+        return path
+
+    @classmethod
+    def load(cls,
+             path=ranking_index_path):
+
+        with np.load(path, allow_pickle=False) as f:
+            index = cls(f['chocs'])
+            index.n_people = int(f['n_people'])
+            index.max_rank = int(f['max_rank'])
+            index.rank_hist = f['rank_hist']
+            index.rank_sums = f['rank_sums']
+            index.wins = f['wins']
+            index.compared = f['compared']
+
+        return index
+
+
+def as_ranking_index(rankings):
+
+    # accepts an index, a ranking_df or a ranking matrix (chocolates best first)
+    if isinstance(rankings, RankingIndex):
+        return rankings
+
+    if hasattr(rankings, 'columns'):
+        return RankingIndex.from_ranking_df(rankings)
+
+    return RankingIndex.from_rankings(rankings)
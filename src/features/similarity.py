@@ -0,0 +1,130 @@
+import numpy as np
+from scipy.spatial.distance import cdist
+
+import os
+
+from src.features.build_features import ranking_df_codes, long_to_positions, thread_pool
+
+
+def ranking_positions(rankings):
+
+    # positions[p, c] is the rank person p gave chocolate c, from either a
+    # ranking matrix (chocolates best first) or a ranking_df
+    if hasattr(rankings, 'columns'):
+        person_codes, choc_codes, ranks, chocs = ranking_df_codes(rankings)
+        return long_to_positions(person_codes, choc_codes, ranks, len(chocs))
+
+    return np.argsort(np.asarray(rankings), axis=1)
+
+
+def pair_signs(positions,
+               dtype=np.float32):
+
+    # +1 / -1 for every chocolate pair i < j depending on which was ranked
+    # higher, so kendall distances become a matrix product
+    i, j = np.triu_indices(positions.shape[1], k=1)
+
+    return np.sign(positions[:, j] - positions[:, i]).astype(dtype)
+
+
+def _output(n_people,
+            out,
+            dtype):
+
+    if out is None:
+        return np.empty((n_people, n_people), dtype=dtype)
+
+    if isinstance(out, (str, os.PathLike)):
+        # written block by block so the full matrix never has to fit in memory
+        return np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=(n_people, n_people))
+
+    return out
+
+
+def _run_blocks(compute_block,
+                n_people,
+                out,
+                block_size,
+                n_jobs):
+
+    # the matrix is filled in block_size x block_size tiles, so each thread
+    # holds one tile of temporaries and peak memory does not grow with n_people
+    starts = range(0, n_people, block_size)
+    tiles = [(slice(row, min(row + block_size, n_people)), slice(col, min(col + block_size, n_people)))
+             for row in starts for col in starts]
+
+    def run(tile):
+        rows, cols = tile
+        out[rows, cols] = compute_block(rows, cols)
+
+    with thread_pool(n_jobs) as pool:
+        list(pool.map(run, tiles))
+
+    if isinstance(out, np.memmap):
+        out.flush()
+
+    return out
+
+
+def kendall_distance_matrix(rankings,
+                            normalize=False,
+                            block_size=1024,
+                            n_jobs=None,
+                            out=None,
+                            dtype=np.float32):
+
+    # number of discordant chocolate pairs between every pair of people,
+    # as a share of all pairs in [0, 1] when normalize is set; a pair one
+    # person left both chocolates of unranked is tied for them and counts
+    # as half discordant
+    signs = pair_signs(ranking_positions(rankings))
+    n_people, n_pairs = signs.shape
+    scale = 2 * n_pairs if normalize else 2
+
+    def compute_block(rows, cols):
+        block = signs[rows] @ signs[cols].T
+        np.subtract(n_pairs, block, out=block)
+        block /= scale
+        return block
+
+    return _run_blocks(compute_block, n_people, _output(n_people, out, dtype), block_size, n_jobs)
+
+
+def kendall_tau_matrix(rankings,
+                       block_size=1024,
+                       n_jobs=None,
+                       out=None,
+                       dtype=np.float32):
+
+    # kendall's tau between every pair of people, a similarity with 1 on the
+    # diagonal, equal to 1 - 2 * kendall_distance_matrix(normalize=True)
+    signs = pair_signs(ranking_positions(rankings))
+    n_people, n_pairs = signs.shape
+
+    def compute_block(rows, cols):
+        block = signs[rows] @ signs[cols].T
+        block /= n_pairs
+        return block
+
+    return _run_blocks(compute_block, n_people, _output(n_people, out, dtype), block_size, n_jobs)
+
+
+def footrule_distance_matrix(rankings,
+                             normalize=False,
+                             block_size=1024,
+                             n_jobs=None,
+                             out=None,
+                             dtype=np.float32):
+
+    # sum of absolute rank differences, scaled to [0, 1] when normalize is set
+    positions = ranking_positions(rankings).astype(np.float64)
+    n_people, n_chocs = positions.shape
+    max_distance = (n_chocs ** 2) // 2
+
+    def compute_block(rows, cols):
+        distance = cdist(positions[rows], positions[cols], metric='cityblock')
+        if normalize:
+            distance /= max_distance
+        return distance
+
+    return _run_blocks(compute_block, n_people, _output(n_people, out, dtype), block_size, n_jobs)
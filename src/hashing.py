@@ -0,0 +1,44 @@
+import sys
+import inspect
+import hashlib
+
+
+def file_hash(path):
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def src_dependencies(module_name):
+
+    # the src modules a module uses, itself included, following what each
+    # one imports at module level, so caches keyed on their source are
+    # invalidated by a change anywhere in the code they run
+    found = set()
+    todo = [module_name]
+    while todo:
+        name = todo.pop()
+        if name in found:
+            continue
+        found.add(name)
+
+        for value in vars(sys.modules[name]).values():
+            module = value if inspect.ismodule(value) else inspect.getmodule(value)
+            if module is not None and module.__name__.startswith('src.'):
+                todo.append(module.__name__)
+
+    return sorted(found)
+
+
+def modules_hash(module_names):
+
+    # ordered by file, so a module run as __main__ hashes as when imported
+    digest = hashlib.sha256()
+    for module in sorted((sys.modules[name] for name in module_names), key=lambda m: m.__file__):
+        digest.update(inspect.getsource(module).encode())
+
+    return digest.hexdigest()
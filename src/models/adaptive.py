@@ -0,0 +1,206 @@
+import numpy as np
+from scipy.special import ndtr
+
+from math import factorial
+
+from src.models.predict_model import PreferencePredictor
+
+# the answer to a subset question is one of k! orders, so larger subsets are
+# refused rather than left to exhaust memory
+max_subset_size = 5
+
+
+def binary_entropy(p):
+
+    p = np.clip(p, 1e-7, 1 - 1e-7)
+
+    return -(p * np.log(p) + (1 - p) * np.log1p(-p))
+
+
+def categorical_entropy(p,
+                        axis=-1):
+
+    return -(p * np.log(np.maximum(p, 1e-12))).sum(axis=axis)
+
+
+class AdaptiveSurvey():
+
+    def __init__(self,
+                 posterior,
+                 max_draws=256,
+                 seed=0,
+                 dtype=np.float32):
+
+        if not isinstance(posterior, PreferencePredictor):
+            posterior = PreferencePredictor(posterior, n_rank_sims=1)
+
+        self.predictor = posterior
+        self.chocs = posterior.chocs
+        self.n_chocs = posterior.n_chocs
+
+        self.rng = np.random.default_rng(seed)
+
+        # a thinned subset of draws is enough to rank questions and keeps the
+        # cached matrices to draws x pairs
+        step = max(1, posterior.n_draws // max_draws)
+        self.mus = posterior.mus[::step].astype(dtype)
+        self.sigmas = posterior.sigmas[::step].astype(dtype)
+        self.n_draws = self.mus.shape[0]
+
+        # P(a new person prefers i over j) and its entropy under every draw,
+        # for each pair i < j, computed once and reused for every request
+        self.pair_i, self.pair_j = np.triu_indices(self.n_chocs, k=1)
+        self.pair_lookup = np.full((self.n_chocs, self.n_chocs), -1)
+        self.pair_lookup[self.pair_i, self.pair_j] = np.arange(len(self.pair_i))
+        self.pair_lookup[self.pair_j, self.pair_i] = np.arange(len(self.pair_i))
+
+        scale = np.sqrt(self.sigmas[:, self.pair_i] ** 2 + self.sigmas[:, self.pair_j] ** 2)
+        self.pair_probs = ndtr((self.mus[:, self.pair_i] - self.mus[:, self.pair_j]) / scale).astype(dtype)
+        self.pair_entropy = binary_entropy(self.pair_probs).astype(dtype)
+
+    def _answer_idx(self,
+                    answers):
+
+        answers = np.asarray(answers).reshape(-1, 2)
+        winners = self.predictor.to_idx(answers[:, 0]).astype(int)
+        losers = self.predictor.to_idx(answers[:, 1]).astype(int)
+
+        # a chocolate against itself has no pair, and pair_lookup's -1 would
+        # silently pick the last pair instead
+        if (winners == losers).any():
+            raise ValueError('answers compare a chocolate with itself')
+
+        return winners, losers
+
+    def weights(self,
+                answers=()):
+
+        # importance weights of the draws given the respondent's answers so
+        # far, each answer a (winner, loser) pair treated as independent given the draw
+        winners, losers = self._answer_idx(answers)
+        if winners.size == 0:
+            return np.full(self.n_draws, 1 / self.n_draws, dtype=self.pair_probs.dtype)
+
+        pairs = self.pair_lookup[winners, losers]
+        probs = self.pair_probs[:, pairs]
+        probs = np.where(winners < losers, probs, 1 - probs)
+
+        log_weights = np.log(np.maximum(probs, 1e-12)).sum(axis=1)
+        weights = np.exp(log_weights - log_weights.max())
+
+        return weights / weights.sum()
+
+    def pair_eig(self,
+                 answers=()):
+
+        # mutual information between the answer and the draw,
+        # H(sum_d w_d p_d) - sum_d w_d H(p_d), for every pair at once
+        weights = self.weights(answers)
+
+        eig = binary_entropy(weights @ self.pair_probs) - weights @ self.pair_entropy
+
+        winners, losers = self._answer_idx(answers)
+        eig[self.pair_lookup[winners, losers]] = -np.inf
+
+        return eig
+
+    def next_pair(self,
+                  answers=()):
+
+        eig = self.pair_eig(answers)
+        best = int(np.argmax(eig))
+
+        return {'pair': [self.chocs[self.pair_i[best]], self.chocs[self.pair_j[best]]],
+                'eig': float(eig[best])}
+
+    def _noise(self,
+               n_sims,
+               k):
+
+        # shared standard normals, so candidates are compared on common random
+        # numbers and repeat requests skip the generation; the subset position
+        # comes first so each chocolate's ratings are contiguous
+        if getattr(self, '_noise_cache', np.empty((0, 0, 0))).shape != (k, self.n_draws, n_sims):
+            self._noise_cache = self.rng.standard_normal((k, self.n_draws, n_sims), dtype=self.mus.dtype)
+
+        return self._noise_cache
+
+    def subset_eig(self,
+                   subsets,
+                   answers=(),
+                   n_sims=64):
+
+        # the answer to a subset question is the order of its k chocolates;
+        # the probability of each order under every draw is estimated from
+        # simulated ratings, vectorised over draws and subsets
+        subsets = np.asarray([self.predictor.to_idx(subset) for subset in subsets]).astype(int)
+        n_subsets, k = subsets.shape
+
+        weights = self.weights(answers)
+
+        # ratings[i, d, s, q] is the simulated rating of the i-th chocolate of subset q
+        noise = self._noise(n_sims, k)[..., None]
+        ratings = (self.mus[:, subsets].transpose(2, 0, 1)[:, :, None, :]
+                   + self.sigmas[:, subsets].transpose(2, 0, 1)[:, :, None, :] * noise)
+
+        # an order is coded by its lehmer code: for each chocolate, the number
+        # of later ones preferred to it, as a factorial base digit, which
+        # numbers the k! orders consecutively
+        outcome = np.zeros((self.n_draws, n_sims, n_subsets), dtype=np.int32)
+        for i in range(k - 1):
+            digit = (ratings[i] < ratings[i + 1]).astype(np.int32)
+            for j in range(i + 2, k):
+                digit += ratings[i] < ratings[j]
+            outcome += digit * factorial(k - 1 - i)
+
+        n_outcomes = factorial(k)
+        cells = (np.arange(self.n_draws)[:, None, None] * n_subsets + np.arange(n_subsets)) * n_outcomes + outcome
+        probs = np.bincount(cells.ravel(), minlength=self.n_draws * n_subsets * n_outcomes)
+        probs = probs.reshape(self.n_draws, n_subsets, n_outcomes) / n_sims
+
+        marginal = np.einsum('d,dso->so', weights, probs)
+
+        return categorical_entropy(marginal) - weights @ categorical_entropy(probs)
+
+    def candidate_subsets(self,
+                          k,
+                          answers=(),
+                          n_candidates=20):
+
+        # grow each of the most informative pairs by the chocolates most
+        # informative to compare against the subset so far
+        eig = self.pair_eig(answers)
+        pair_eig = np.zeros((self.n_chocs, self.n_chocs))
+        pair_eig[self.pair_i, self.pair_j] = np.maximum(eig, 0)
+        pair_eig += pair_eig.T
+
+        top = np.argpartition(-eig, min(n_candidates, len(eig)) - 1)[:n_candidates]
+        subsets = []
+        for best in top:
+            subset = [self.pair_i[best], self.pair_j[best]]
+            while len(subset) < k:
+                gain = pair_eig[subset].sum(axis=0)
+                gain[subset] = -np.inf
+                subset.append(int(np.argmax(gain)))
+            subsets.append(subset)
+
+        return np.array(subsets)
+
+    def next_subset(self,
+                    k=3,
+                    answers=(),
+                    n_candidates=20,
+                    n_sims=64):
+
+        if not 2 <= k <= min(self.n_chocs, max_subset_size):
+            raise ValueError('k must be between 2 and {n}'.format(n=min(self.n_chocs, max_subset_size)))
+
+        if k == 2:
+            return self.next_pair(answers)
+
+        subsets = self.candidate_subsets(k, answers=answers, n_candidates=n_candidates)
+        eig = self.subset_eig(subsets, answers=answers, n_sims=n_sims)
+        best = int(np.argmax(eig))
+
+        return {'subset': [self.chocs[i] for i in subsets[best]],
+                'eig': float(eig[best])}
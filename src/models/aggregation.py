@@ -0,0 +1,82 @@
+import numpy as np
+
+from src.features.build_features import as_ranking_index
+
+
+# every method returns chocolate indices ordered from most to least preferred
+
+
+def borda(rankings):
+
+    # lowest mean rank first, which is the borda count when rankings are complete
+    index = as_ranking_index(rankings)
+
+    return np.argsort(index.mean_rank, kind='stable')
+
+
+def copeland(rankings):
+
+    # pairwise majority wins minus losses, ties broken by borda
+    index = as_ranking_index(rankings)
+
+    scores = np.sign(index.wins - index.wins.T).sum(axis=1)
+
+    return np.lexsort((index.mean_rank, -scores))
+
+
+def kemeny_disagreements(wins,
+                         order):
+
+    # people disagreeing with each pairwise order implied by the ranking
+    ordered = wins[np.ix_(order, order)]
+
+    return int(np.tril(ordered, k=-1).sum())
+
+
+def kemeny_local_search(rankings,
+                        init=None,
+                        max_iter=None):
+
+    # best-improvement insertion moves from a borda start; each pass scores
+    # moving every chocolate to every position at once from cumulative sums
+    index = as_ranking_index(rankings)
+    order = borda(index) if init is None else np.asarray(init).copy()
+
+    n_chocs = len(order)
+    max_iter = max_iter or 10 * n_chocs ** 2
+    below = np.tri(n_chocs, k=-1, dtype=bool)
+
+    for _ in range(max_iter):
+
+        ordered = index.wins[np.ix_(order, order)].astype(np.float64)
+        net = ordered - ordered.T
+
+        # delta[q, p] is the change in disagreements when the chocolate at
+        # position p is moved to position q
+        up = np.cumsum(np.where(below.T, net, 0)[::-1], axis=0)[::-1]
+        down = np.cumsum(np.where(below, -net, 0), axis=0)
+        delta = np.where(below.T, up, 0) + np.where(below, down, 0)
+
+        q, p = np.unravel_index(np.argmin(delta), delta.shape)
+        if delta[q, p] >= 0:
+            break
+
+        order = np.insert(np.delete(order, p), q, order[p])
+
+    return order
+
+
+methods = {'borda': borda,
+           'copeland': copeland,
+           'kemeny': kemeny_local_search}
+
+
+def aggregate(rankings,
+              method='kemeny'):
+
+    index = as_ranking_index(rankings)
+    order = methods[method](index)
+
+    return {'order': order,
+            'chocs': index.chocs[order],
+            'disagreements': kemeny_disagreements(index.wins, order)}
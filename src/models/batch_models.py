@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+
+import os
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from cmdstanpy import CmdStanModel
+
+from src.models.stan_models import StanModel, ranking_df_to_array, make_stan_data, git_root
+from src.models.stan_output import stream_csv_files
+
+
+logger = logging.getLogger(__name__)
+
+batch_output_dir = os.path.join(git_root, 'models', 'batch')
+
+
+def split_segments(ranking_df,
+                   segment_col):
+
+    return {segment: ranking_df_to_array(segment_df)
+            for segment, segment_df in ranking_df.groupby(segment_col)}
+
+
+def _as_datasets(datasets,
+                 segment_col):
+
+    if isinstance(datasets, pd.DataFrame):
+        return split_segments(datasets, segment_col)
+
+    if isinstance(datasets, dict):
+        return {segment: (ranking_df_to_array(data) if isinstance(data, pd.DataFrame) else data)
+                for segment, data in datasets.items()}
+
+    return {i: data for i, data in enumerate(datasets)}
+
+
+def _fit_segment(exe_file,
+                 segment,
+                 choc_rankings_array,
+                 output_dir,
+                 draws_vars,
+                 sample_kwargs):
+
+    timings = {'start': time.time()}
+    result = {'segment': segment,
+              'n_people': choc_rankings_array.shape[0],
+              'output_dir': output_dir,
+              'csv_files': [],
+              'draws_dir': None,
+              'timings': timings,
+              'error': None}
+
+    try:
+        # every worker reuses the executable compiled once by the parent
+        model = CmdStanModel(exe_file=exe_file)
+
+        fit = model.sample(make_stan_data(choc_rankings_array),
+                           output_dir=os.path.join(output_dir, 'csv'),
+                           **sample_kwargs)
+        timings['sample'] = time.time() - timings['start']
+
+        result['csv_files'] = list(fit.runset.csv_files)
+        result['draws_dir'] = stream_csv_files(result['csv_files'],
+                                               os.path.join(output_dir, 'draws'),
+                                               stan_vars=draws_vars)
+        timings['convert'] = time.time() - timings['start'] - timings['sample']
+
+    except Exception as e:
+        result['error'] = repr(e)
+
+    timings['end'] = time.time()
+    timings['wall'] = timings['end'] - timings['start']
+
+    return result
+
+
+def fit_batch(datasets,
+              filename='choc_model.stan',
+              segment_col='segment',
+              chains=4,
+              threads_per_chain=1,
+              core_budget=None,
+              output_dir=batch_output_dir,
+              draws_vars=None,
+              **kwargs):
+
+    datasets = _as_datasets(datasets, segment_col)
+
+    # threads_per_chain only takes effect in an executable built with STAN_THREADS,
+    # and one compiled earlier without it is not rebuilt on its own
+    if threads_per_chain > 1:
+        stan_model = StanModel(filename, cpp_options={'STAN_THREADS': True})
+        if stan_model.exe_info().get('STAN_THREADS', '').lower() != 'true':
+            stan_model.compile(force=True)
+    else:
+        stan_model = StanModel(filename)
+
+    exe_file = stan_model.exe_file
+
+    # each fit runs its chains in parallel, so the pool is sized to keep
+    # chains x threads x workers within the core budget
+    core_budget = core_budget or os.cpu_count()
+    cores_per_fit = chains * threads_per_chain
+    n_workers = max(1, min(len(datasets), core_budget // cores_per_fit))
+
+    sample_kwargs = dict(chains=chains,
+                         parallel_chains=chains,
+                         **kwargs)
+    if threads_per_chain > 1:
+        sample_kwargs['threads_per_chain'] = threads_per_chain
+
+    logger.info('fitting {n} segments on {w} workers'.format(n=len(datasets), w=n_workers))
+
+    results = {}
+    queued = time.time()
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+
+        futures = {pool.submit(_fit_segment,
+                               exe_file,
+                               segment,
+                               np.asarray(data),
+                               os.path.join(output_dir, str(segment)),
+                               draws_vars,
+                               sample_kwargs): segment
+                   for segment, data in datasets.items()}
+
+        for future in as_completed(futures):
+            result = future.result()
+            result['timings']['queued'] = result['timings']['start'] - queued
+            results[futures[future]] = result
+
+            if result['error'] is not None:
+                logger.warning('segment {s} failed: {e}'.format(s=result['segment'], e=result['error']))
+            else:
+                logger.info('segment {s} done in {t:.1f}s'.format(s=result['segment'],
+                                                                 t=result['timings']['wall']))
+
+    return {segment: results[segment] for segment in datasets}
+
+
+def batch_timings(results):
+
+    return pd.DataFrame([dict(segment=r['segment'],
+                              n_people=r['n_people'],
+                              error=r['error'],
+                              **r['timings']) for r in results.values()])
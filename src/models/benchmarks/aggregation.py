@@ -0,0 +1,101 @@
+import click
+import logging
+
+import numpy as np
+import pandas as pd
+from scipy.stats import kendalltau
+
+import time
+
+from src.features.build_features import RankingIndex, ranking_index_path
+from src.models.aggregation import methods
+from src.models.predict_model import load_posterior
+
+logger = logging.getLogger(__name__)
+
+
+def simulate_rankings(n_people,
+                      n_chocs,
+                      seed=123):
+
+    # same generative process as SimGenerative.draw without building its dataframes
+    rng = np.random.default_rng(seed)
+
+    choc_mus = rng.normal(0, 1, size=n_chocs)
+    choc_sigmas = rng.gamma(5, 0.5, size=n_chocs)
+    rankings = np.empty((n_people, n_chocs), dtype=np.int32)
+
+    for start in range(0, n_people, 100000):
+        stop = min(start + 100000, n_people)
+        ratings = rng.normal(choc_mus, choc_sigmas, size=(stop - start, n_chocs))
+        rankings[start:stop] = np.argsort(-ratings, axis=1)
+
+    return rankings, choc_mus
+
+
+def order_agreement(order,
+                    reference_scores):
+
+    # kendall's tau between a consensus order and scores where higher is better
+    positions = np.empty(len(order), dtype=np.int64)
+    positions[order] = np.arange(len(order))
+
+    return kendalltau(-positions, reference_scores)[0]
+
+
+def posterior_scores(posterior,
+                     chocs):
+
+    # posterior mean latent rating per chocolate, aligned to the index labels
+    scores = np.asarray(posterior['choc_mus_adj']).mean(axis=0)
+    if 'chocs' in posterior:
+        scores = pd.Series(scores, index=posterior['chocs']).reindex(chocs).to_numpy()
+
+    return scores
+
+
+def run_benchmark(index,
+                  reference_scores,
+                  index_seconds=None):
+
+    results = []
+    for name, method in methods.items():
+        start = time.perf_counter()
+        order = method(index)
+        results.append({'method': name,
+                        'seconds': time.perf_counter() - start,
+                        'index_seconds': index_seconds,
+                        'tau': order_agreement(order, reference_scores)})
+
+    return pd.DataFrame(results)
+
+
+@click.command()
+@click.option('--posterior', default=None,
+              help='saved fit to compare the observed rankings against, otherwise simulated data is used')
+@click.option('--index', 'index_path', default=ranking_index_path, type=click.Path())
+@click.option('--n-people', default=1000000, type=int)
+@click.option('--n-chocs', default=200, type=int)
+@click.option('--seed', default=123, type=int)
+def main(posterior, index_path, n_people, n_chocs, seed):
+    """ Times the consensus rankings and reports their kendall's tau against
+        the posterior mean ratings, or the true ratings of simulated data.
+    """
+    if posterior is not None:
+        index = RankingIndex.load(index_path)
+        results = run_benchmark(index, posterior_scores(load_posterior(posterior), index.chocs))
+    else:
+        rankings, choc_mus = simulate_rankings(n_people, n_chocs, seed=seed)
+
+        start = time.perf_counter()
+        index = RankingIndex.from_rankings(rankings)
+        results = run_benchmark(index, choc_mus, index_seconds=time.perf_counter() - start)
+
+    logger.info('\n' + results.to_string(index=False))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
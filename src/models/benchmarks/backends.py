@@ -0,0 +1,112 @@
+import click
+import logging
+
+import pandas as pd
+
+import time
+
+from src.data.generative import SimGenerative
+from src.models.stan_models import StanModel
+from src.models.pymc.fixed_sigma import PymcModel
+
+logger = logging.getLogger(__name__)
+
+
+def stan_fit(rankings,
+             **sample_kwargs):
+
+    model = StanModel('choc_model.stan')
+    model.fit(rankings, show_progress=False, **sample_kwargs)
+
+    return model
+
+
+def pymc_fit(rankings,
+             **sample_kwargs):
+
+    # fitted sigmas so both backends sample the same posterior
+    model = PymcModel(fixed_sigma=None)
+    model.fit(rankings, **sample_kwargs)
+
+    return model
+
+
+backends = {'stan': stan_fit,
+            'pymc_jax': pymc_fit}
+
+
+def time_to_first_draws(fit,
+                        rankings,
+                        chains,
+                        seed,
+                        iters=10):
+
+    # startup covers stan's compile (or loading the cached executable) and
+    # pytensor's graph build plus the jax jit, which only happen on a call
+    start = time.perf_counter()
+    fit(rankings, chains=chains, iter_warmup=iters, iter_sampling=iters, seed=seed)
+
+    return time.perf_counter() - start
+
+
+def run_benchmark(rankings,
+                  chains=4,
+                  iter_warmup=1000,
+                  iter_sampling=1000,
+                  seed=123,
+                  ess_vars=('choc_mus_fitted', 'choc_sigmas_fitted')):
+
+    results = []
+    for name, fit in backends.items():
+
+        startup = time_to_first_draws(fit, rankings, chains, seed)
+        model = fit(rankings,
+                    chains=chains,
+                    iter_warmup=iter_warmup,
+                    iter_sampling=iter_sampling,
+                    seed=seed)
+
+        # per second of the whole sample call, warmup and any jit included,
+        # since cmdstan and numpyro split their timings differently
+        sample_seconds = model.fit_stats.stages['sample']['wall']
+        result = {'backend': name,
+                  'startup_seconds': startup,
+                  'sample_seconds': sample_seconds,
+                  'divergences': model.fit_stats.sampler['divergences']}
+        for stan_var in ess_vars:
+            ess = model.fit_stats.ess[stan_var]
+            result['{var}_ess_min_per_sec'.format(var=stan_var)] = ess['min'] / sample_seconds
+            result['{var}_ess_median_per_sec'.format(var=stan_var)] = ess['median'] / sample_seconds
+        results.append(result)
+
+    return pd.DataFrame(results)
+
+
+@click.command()
+@click.option('--n-people', default=100, type=int)
+@click.option('--n-chocs', default=17, type=int)
+@click.option('--chains', default=4, type=int)
+@click.option('--iter-warmup', default=1000, type=int)
+@click.option('--iter-sampling', default=1000, type=int)
+@click.option('--seed', default=123, type=int)
+def main(n_people, n_chocs, chains, iter_warmup, iter_sampling, seed):
+    """ Fits simulated rankings with choc_model.stan and the jax-compiled pymc
+        model, reporting startup time and ESS per second for each.
+    """
+    sim = SimGenerative(n_people=n_people, n_chocs=n_chocs, seed=seed)
+    sim.draw()
+
+    results = run_benchmark(sim.choc_rankings,
+                            chains=chains,
+                            iter_warmup=iter_warmup,
+                            iter_sampling=iter_sampling,
+                            seed=seed)
+
+    logger.info('\n' + results.to_string(index=False))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,78 @@
+import click
+import logging
+
+import pandas as pd
+
+from src.data.generative import SimGenerative
+from src.models.stan_models import StanModel
+
+logger = logging.getLogger(__name__)
+
+
+def run_benchmark(sim,
+                  model='choc_model',
+                  warmups=(1000, 500, 250, 100),
+                  **sample_kwargs):
+
+    # shorter warmups are only worth having if the chains still converge, so
+    # each fit reports its worst r-hat and ESS alongside the warmup time;
+    # StanModel.fit replaces itself with the result, so every fit gets its
+    # own StanModel (the compiled executable is reused)
+    results = []
+    for inits in (None, 'data'):
+        for iter_warmup in warmups:
+            stan_model = StanModel(model)
+            stan_model.fit(sim.choc_rankings,
+                           iter_warmup=iter_warmup,
+                           inits=inits,
+                           show_progress=False,
+                           **sample_kwargs)
+
+            stats = stan_model.fit_stats
+            summary = stan_model.fit.summary()
+            results.append({'inits': inits or 'random',
+                            'iter_warmup': iter_warmup,
+                            'warmup_seconds': max(s for s in stats.sampler['warmup_seconds'] if s is not None),
+                            'sample_seconds': stats.stages['sample']['wall'],
+                            'divergences': stats.sampler['divergences'],
+                            'r_hat_max': summary['R_hat'].max(),
+                            'ess_min': min(ess['min'] for ess in stats.ess.values())})
+
+    return pd.DataFrame(results)
+
+
+@click.command()
+@click.option('--model', default='choc_model')
+@click.option('--n-people', default=100, type=int)
+@click.option('--n-chocs', default=17, type=int)
+@click.option('--chains', default=4, type=int)
+@click.option('--iter-sampling', default=1000, type=int)
+@click.option('--warmup', 'warmups', multiple=True, type=int, default=[1000, 500, 250, 100])
+@click.option('--step-size', default=None, type=float)
+@click.option('--seed', default=123, type=int)
+def main(model, n_people, n_chocs, chains, iter_sampling, warmups, step_size, seed):
+    """ Fits SimGenerative data from random and ranking-derived inits over a
+        range of warmup lengths, reporting warmup time and convergence.
+    """
+    sim = SimGenerative(n_people=n_people, n_chocs=n_chocs, seed=seed)
+    sim.draw()
+
+    sample_kwargs = {'chains': chains,
+                     'iter_sampling': iter_sampling,
+                     'seed': seed}
+    if step_size is not None:
+        sample_kwargs['step_size'] = step_size
+
+    results = run_benchmark(sim,
+                            model=model,
+                            warmups=warmups,
+                            **sample_kwargs)
+
+    logger.info('\n' + results.to_string(index=False))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,87 @@
+import click
+import logging
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+
+import time
+
+from src.models.mixture import PlackettLuceMixture
+
+logger = logging.getLogger(__name__)
+
+
+def simulate_clusters(n_clusters,
+                      n_people,
+                      n_chocs,
+                      seed=123):
+
+    # plackett-luce rankings by sorting log worths plus gumbel noise, with
+    # uneven cluster sizes
+    rng = np.random.default_rng(seed)
+
+    log_worths = rng.normal(0, 1.5, size=(n_clusters, n_chocs))
+    weights = rng.dirichlet(np.full(n_clusters, 5))
+    clusters = rng.choice(n_clusters, size=n_people, p=weights)
+    rankings = np.empty((n_people, n_chocs), dtype=np.int32)
+
+    for start in range(0, n_people, 100000):
+        stop = min(start + 100000, n_people)
+        noisy = log_worths[clusters[start:stop]] + rng.gumbel(size=(stop - start, n_chocs))
+        rankings[start:stop] = np.argsort(-noisy, axis=1)
+
+    return rankings, clusters, log_worths
+
+
+def cluster_accuracy(labels,
+                     clusters,
+                     n_clusters):
+
+    # share of people assigned correctly under the best matching of fitted to true clusters
+    counts = np.zeros((n_clusters, n_clusters))
+    np.add.at(counts, (labels, clusters), 1)
+    rows, cols = linear_sum_assignment(-counts)
+
+    return counts[rows, cols].sum() / len(labels)
+
+
+@click.command()
+@click.option('--n-clusters', default=4, type=int)
+@click.option('--n-people', default='10000,100000,1000000',
+              help='comma separated respondent counts to time')
+@click.option('--n-chocs', default=17, type=int)
+@click.option('--n-init', default=3, type=int)
+@click.option('--chunk-size', default=100000, type=int)
+@click.option('--n-jobs', default=None, type=int)
+@click.option('--seed', default=123, type=int)
+def main(n_clusters, n_people, n_chocs, n_init, chunk_size, n_jobs, seed):
+    """ Fits the plackett-luce mixture to simulated clustered rankings of
+        increasing size, reporting wall time and how well the clusters are
+        recovered.
+    """
+    results = []
+    for size in [int(n) for n in n_people.split(',')]:
+        rankings, clusters, _ = simulate_clusters(n_clusters, size, n_chocs, seed=seed)
+
+        start = time.perf_counter()
+        model = PlackettLuceMixture(n_clusters=n_clusters,
+                                    n_init=n_init,
+                                    chunk_size=chunk_size,
+                                    n_jobs=n_jobs,
+                                    seed=seed).fit(rankings)
+
+        results.append({'n_people': size,
+                        'seconds': time.perf_counter() - start,
+                        'n_iter': model.n_iter,
+                        'converged': model.converged,
+                        'accuracy': cluster_accuracy(model.labels, clusters, n_clusters)})
+
+    logger.info('\n' + pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
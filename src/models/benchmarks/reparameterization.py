@@ -0,0 +1,121 @@
+import click
+import logging
+
+import numpy as np
+import pandas as pd
+
+from src.data.generative import SimGenerative
+from src.models.stan_models import StanModel
+
+logger = logging.getLogger(__name__)
+
+# choc_model.stan is run with the step size it is fitted with in chocbook
+model_sample_kwargs = {'choc_model': {'step_size': 0.01},
+                       'choc_model_nc': {}}
+
+
+# variables both models declare with the same posterior
+compared_vars = ('choc_mus_adj', 'choc_sigmas_fitted', 'choc_sigmas_alpha', 'choc_sigmas_mean', 'ratings')
+
+
+def standardise(mus):
+
+    # the simulated ratings are only recovered up to location and scale
+    return (mus - mus.mean()) / mus.std(ddof=1)
+
+
+def fit_summary(model,
+                choc_mus,
+                choc_sigmas):
+
+    stats = model.fit_stats
+    mus_mean = standardise(model.get_stan_variable('choc_mus_adj').mean(axis=0))
+    sigmas_mean = model.get_stan_variable('choc_sigmas_fitted').mean(axis=0)
+
+    summary = {'sample_seconds': stats.stages['sample']['wall'],
+               'warmup_seconds': max(s for s in stats.sampler['warmup_seconds'] if s is not None),
+               'divergences': stats.sampler['divergences'],
+               'gradient_evals': stats.sampler['gradient_evals'],
+               'mus_corr_truth': np.corrcoef(mus_mean, choc_mus)[0, 1],
+               'sigmas_corr_truth': np.corrcoef(sigmas_mean, choc_sigmas)[0, 1]}
+
+    for stan_var, ess in stats.ess.items():
+        summary['{var}_ess_min_per_sec'.format(var=stan_var)] = ess['min_per_sec']
+        summary['{var}_ess_min_per_grad'.format(var=stan_var)] = ess['min'] / stats.sampler['gradient_evals']
+
+    return summary
+
+
+def posterior_agreement(reference,
+                        draws,
+                        quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+
+    # differences in posterior means and quantiles in units of the reference
+    # posterior sd, and the ratio of sds, worst case over the elements
+    reference = reference.reshape(reference.shape[0], -1)
+    draws = draws.reshape(draws.shape[0], -1)
+    sd = np.maximum(reference.std(axis=0), 1e-12)
+
+    return {'mean_max_diff_sd': (np.abs(draws.mean(axis=0) - reference.mean(axis=0)) / sd).max(),
+            'quantile_max_diff_sd': (np.abs(np.quantile(draws, quantiles, axis=0) -
+                                            np.quantile(reference, quantiles, axis=0)) / sd).max(),
+            'sd_ratio_min': (draws.std(axis=0) / sd).min(),
+            'sd_ratio_max': (draws.std(axis=0) / sd).max()}
+
+
+def run_benchmark(sim,
+                  models=tuple(model_sample_kwargs),
+                  **sample_kwargs):
+
+    results, fitted = [], {}
+    for name in models:
+        model = StanModel(name)
+        model.fit(sim.choc_rankings,
+                  show_progress=False,
+                  **dict(sample_kwargs, **model_sample_kwargs.get(name, {})))
+
+        results.append(dict(model=name, **fit_summary(model, sim.choc_mus, sim.choc_sigmas)))
+        fitted[name] = model
+
+    # every model against the first, variable by variable; the reparameterised
+    # model should only differ by monte carlo error
+    agreement = pd.DataFrame([dict(model=name,
+                                   stan_var=stan_var,
+                                   **posterior_agreement(fitted[models[0]].get_stan_variable(stan_var),
+                                                         model.get_stan_variable(stan_var)))
+                              for name, model in fitted.items()
+                              for stan_var in compared_vars])
+
+    return pd.DataFrame(results), agreement
+
+
+@click.command()
+@click.option('--n-people', default=100, type=int)
+@click.option('--n-chocs', default=17, type=int)
+@click.option('--chains', default=4, type=int)
+@click.option('--iter-warmup', default=1000, type=int)
+@click.option('--iter-sampling', default=1000, type=int)
+@click.option('--seed', default=123, type=int)
+def main(n_people, n_chocs, chains, iter_warmup, iter_sampling, seed):
+    """ Fits SimGenerative data with choc_model.stan and choc_model_nc.stan,
+        reporting ESS per second and per gradient, divergences and how closely
+        the posteriors of the shared variables agree.
+    """
+    sim = SimGenerative(n_people=n_people, n_chocs=n_chocs, seed=seed)
+    sim.draw()
+
+    results, agreement = run_benchmark(sim,
+                                       chains=chains,
+                                       iter_warmup=iter_warmup,
+                                       iter_sampling=iter_sampling,
+                                       seed=seed)
+
+    logger.info('\n' + results.to_string(index=False))
+    logger.info('\n' + agreement.to_string(index=False))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,138 @@
+import click
+import logging
+
+import numpy as np
+import pandas as pd
+import cmdstanpy
+
+import os
+import time
+
+from src.models.stan_models import StanModel, git_root
+from src.models.batch_models import fit_batch
+from src.models.stan_output import load_stan_variable
+
+logger = logging.getLogger(__name__)
+
+benchmark_output_dir = os.path.join(git_root, 'models', 'benchmarks', 'segments')
+
+
+def simulate_segments(n_segments,
+                      n_people,
+                      n_chocs,
+                      segment_sd=0.5,
+                      seed=123):
+
+    # shared mean ratings with a normal offset per segment, people split evenly
+    rng = np.random.default_rng(seed)
+
+    choc_mus = rng.normal(0, 1, size=n_chocs)
+    segment_mus = choc_mus + segment_sd * rng.normal(size=(n_segments, n_chocs))
+    choc_sigmas = rng.gamma(5, 0.5, size=n_chocs)
+
+    segments = np.arange(n_people) % n_segments
+    ratings = rng.normal(segment_mus[segments], choc_sigmas, size=(n_people, n_chocs))
+
+    return np.argsort(-ratings, axis=1), segments, segment_mus
+
+
+def standardise(mus):
+
+    return (mus - mus.mean(axis=-1, keepdims=True)) / mus.std(axis=-1, ddof=1, keepdims=True)
+
+
+def recovery(fitted_mus,
+             segment_mus):
+
+    # mean correlation between the posterior mean and true segment ratings
+    return np.mean([np.corrcoef(fitted, true)[0, 1]
+                    for fitted, true in zip(standardise(fitted_mus), standardise(segment_mus))])
+
+
+def gradient_evals(csv_files):
+
+    return int(cmdstanpy.from_csv(csv_files).method_variables()['n_leapfrog__'].sum())
+
+
+def run_benchmark(rankings,
+                  segments,
+                  segment_mus,
+                  chains=4,
+                  output_dir=benchmark_output_dir,
+                  **sample_kwargs):
+
+    n_segments = segment_mus.shape[0]
+
+    # separate fits get the same cores as the joint fit, so they run one at a time
+    start = time.perf_counter()
+    results = fit_batch({s: rankings[segments == s] for s in range(n_segments)},
+                        chains=chains,
+                        core_budget=chains,
+                        output_dir=os.path.join(output_dir, 'separate'),
+                        show_progress=False,
+                        **sample_kwargs)
+    separate_wall = time.perf_counter() - start
+
+    separate_mus = np.stack([load_stan_variable(results[s]['draws_dir'], 'choc_mus_adj').mean(axis=0)
+                             for s in range(n_segments)])
+
+    start = time.perf_counter()
+    model = StanModel('choc_model_segments')
+    model.fit(rankings,
+              segments=segments,
+              chains=chains,
+              output_dir=os.path.join(output_dir, 'joint'),
+              show_progress=False,
+              **sample_kwargs)
+    joint_wall = time.perf_counter() - start
+
+    joint_mus = model.get_stan_variable('choc_mus_segment').mean(axis=0)
+
+    return pd.DataFrame([{'fit': 'separate',
+                          'n_fits': n_segments,
+                          'wall_seconds': separate_wall,
+                          'gradient_evals': sum(gradient_evals(r['csv_files']) for r in results.values()),
+                          'recovery': recovery(separate_mus, segment_mus)},
+                         {'fit': 'joint',
+                          'n_fits': 1,
+                          'wall_seconds': joint_wall,
+                          'gradient_evals': model.fit_stats.sampler['gradient_evals'],
+                          'recovery': recovery(joint_mus, segment_mus)}])
+
+
+@click.command()
+@click.option('--n-segments', default=4, type=int)
+@click.option('--n-people', default=200, type=int, help='people across all segments')
+@click.option('--n-chocs', default=17, type=int)
+@click.option('--segment-sd', default=0.5, type=float)
+@click.option('--chains', default=4, type=int)
+@click.option('--iter-warmup', default=1000, type=int)
+@click.option('--iter-sampling', default=1000, type=int)
+@click.option('--seed', default=123, type=int)
+def main(n_segments, n_people, n_chocs, segment_sd, chains, iter_warmup, iter_sampling, seed):
+    """ Fits simulated segments once with choc_model_segments.stan and once
+        per segment with fit_batch, reporting total cost and how well each
+        recovers the segment ratings.
+    """
+    rankings, segments, segment_mus = simulate_segments(n_segments,
+                                                        n_people,
+                                                        n_chocs,
+                                                        segment_sd=segment_sd,
+                                                        seed=seed)
+
+    results = run_benchmark(rankings,
+                            segments,
+                            segment_mus,
+                            chains=chains,
+                            iter_warmup=iter_warmup,
+                            iter_sampling=iter_sampling,
+                            seed=seed)
+
+    logger.info('\n' + results.to_string(index=False))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -0,0 +1,148 @@
+import numpy as np
+from scipy.special import ndtr, ndtri
+
+from src.models.predict_model import PreferencePredictor
+
+
+def order_to_comparisons(order):
+
+    # a partial order listed from most to least preferred
+    return [(order[i], order[i + 1]) for i in range(len(order) - 1)]
+
+
+def _constraint_levels(n_chocs,
+                       winners,
+                       losers):
+
+    # longest path from the top of the comparison graph, used to build a
+    # starting point that already satisfies every comparison
+    levels = np.zeros(n_chocs)
+    for _ in range(n_chocs + 1):
+        updated = levels.copy()
+        np.maximum.at(updated, losers, levels[winners] + 1)
+        if np.array_equal(updated, levels):
+            return levels
+        levels = updated
+
+    raise ValueError('comparisons contain a cycle')
+
+
+class ConditionalRanker():
+
+    def __init__(self,
+                 posterior,
+                 max_draws=1000,
+                 seed=0):
+
+        if not isinstance(posterior, PreferencePredictor):
+            posterior = PreferencePredictor(posterior, n_rank_sims=1)
+
+        self.predictor = posterior
+        self.chocs = posterior.chocs
+        self.n_chocs = posterior.n_chocs
+
+        self.rng = np.random.default_rng(seed)
+
+        # a thinned subset of draws keeps a query to a few milliseconds
+        step = max(1, posterior.n_draws // max_draws)
+        self.mus = posterior.mus[::step]
+        self.sigmas = posterior.sigmas[::step]
+
+    def _comparison_idx(self,
+                        comparisons):
+
+        comparisons = np.asarray(comparisons).reshape(-1, 2)
+
+        return (self.predictor.to_idx(comparisons[:, 0]).astype(int),
+                self.predictor.to_idx(comparisons[:, 1]).astype(int))
+
+    def _expand(self,
+                n_sims):
+
+        return (np.repeat(self.mus, n_sims, axis=0),
+                np.repeat(self.sigmas, n_sims, axis=0))
+
+    def sample_gibbs(self,
+                     comparisons,
+                     n_sims=4,
+                     n_sweeps=20):
+
+        winners, losers = self._comparison_idx(comparisons)
+        mus, sigmas = self._expand(n_sims)
+
+        # chocolates outside the comparisons are independent of them given the draw
+        ratings = mus + sigmas * self.rng.standard_normal(mus.shape)
+
+        constrained = np.unique(np.concatenate([winners, losers]))
+        if constrained.size == 0:
+            return ratings
+
+        levels = _constraint_levels(self.n_chocs, winners, losers)
+        ratings[:, constrained] = -levels[constrained]
+
+        beats = {j: losers[winners == j] for j in constrained}
+        beaten_by = {j: winners[losers == j] for j in constrained}
+
+        for _ in range(n_sweeps):
+            for j in constrained:
+
+                lower = ratings[:, beats[j]].max(axis=1) if beats[j].size else np.full(len(ratings), -np.inf)
+                upper = ratings[:, beaten_by[j]].min(axis=1) if beaten_by[j].size else np.full(len(ratings), np.inf)
+
+                # truncated normal by inverting the cdf between the bounds
+                cdf_lower = ndtr((lower - mus[:, j]) / sigmas[:, j])
+                cdf_upper = ndtr((upper - mus[:, j]) / sigmas[:, j])
+                u = cdf_lower + (cdf_upper - cdf_lower) * self.rng.random(len(ratings))
+
+                sample = mus[:, j] + sigmas[:, j] * ndtri(np.clip(u, 1e-12, 1 - 1e-12))
+                ratings[:, j] = np.clip(sample, lower, upper)
+
+        return ratings
+
+    def sample_importance(self,
+                          comparisons,
+                          n_sims=64):
+
+        winners, losers = self._comparison_idx(comparisons)
+        mus, sigmas = self._expand(n_sims)
+
+        ratings = mus + sigmas * self.rng.standard_normal(mus.shape)
+
+        # prior draws weighted by whether they reproduce every comparison
+        weights = np.all(ratings[:, winners] > ratings[:, losers], axis=1).astype(np.float64)
+        if weights.sum() == 0:
+            raise ValueError('no prior draws satisfy the comparisons, use method="gibbs"')
+
+        return ratings, weights / weights.sum()
+
+    def predict(self,
+                comparisons=None,
+                order=None,
+                method='gibbs',
+                **kwargs):
+
+        if order is not None:
+            comparisons = ([] if comparisons is None else list(comparisons)) + order_to_comparisons(order)
+        comparisons = [] if comparisons is None else comparisons
+
+        if method == 'gibbs':
+            ratings = self.sample_gibbs(comparisons, **kwargs)
+            weights = np.full(len(ratings), 1 / len(ratings))
+        elif method == 'importance':
+            ratings, weights = self.sample_importance(comparisons, **kwargs)
+        else:
+            raise ValueError('method must be "gibbs" or "importance"')
+
+        ranks = np.argsort(np.argsort(-ratings, axis=1), axis=1)
+
+        rank_probs = np.bincount((np.arange(self.n_chocs) * self.n_chocs + ranks).ravel(),
+                                 weights=np.repeat(weights, self.n_chocs),
+                                 minlength=self.n_chocs ** 2).reshape(self.n_chocs, self.n_chocs)
+
+        expected_rank = rank_probs @ np.arange(self.n_chocs)
+
+        return {'chocs': self.chocs,
+                'rank_probs': rank_probs,
+                'expected_rank': expected_rank,
+                'ranking': [self.chocs[i] for i in np.argsort(expected_rank, kind='stable')],
+                'ess': 1 / np.sum(weights ** 2)}
@@ -0,0 +1,283 @@
+import pandas as pd
+
+import os
+import re
+import time
+import asyncio
+import tempfile
+import itertools
+
+import cmdstanpy
+from cmdstanpy import write_stan_json
+
+from src.models.stan_models import ranking_df_to_array, make_stan_data, chain_inits
+
+
+# cmdstan reports progress as e.g. "Iteration:  100 / 2000 [  5%]  (Warmup)"
+progress_pattern = re.compile(r'Iteration:\s*(\d+)\s*/\s*(\d+).*\((\w+)\)')
+
+# sample() arguments _chain_args translates to cmdstan, anything else is refused
+# rather than giving a job that differs from the equivalent StanModel.fit
+sampler_arg_names = ('thin', 'adapt_delta', 'max_treedepth', 'step_size', 'inits', 'refresh')
+
+
+class FitHandle():
+
+    def __init__(self,
+                 job_id,
+                 chains):
+
+        self.job_id = job_id
+        self.progress = {chain: {'iteration': 0, 'total': None, 'phase': None}
+                         for chain in range(1, chains + 1)}
+        self.submitted = time.time()
+        self.finished = None
+
+        self._task = None
+
+    @property
+    def status(self):
+
+        if not self._task.done():
+            return 'running'
+        if self._task.cancelled():
+            return 'cancelled'
+        if self._task.exception() is not None:
+            return 'failed'
+
+        return 'done'
+
+    @property
+    def fraction_done(self):
+
+        totals = [p['total'] for p in self.progress.values()]
+        if None in totals:
+            return 0.0
+
+        return sum(p['iteration'] for p in self.progress.values()) / sum(totals)
+
+    def done(self):
+
+        return self._task.done()
+
+    def cancel(self):
+
+        return self._task.cancel()
+
+    def result(self):
+
+        return self._task.result()
+
+    def __await__(self):
+
+        return self._task.__await__()
+
+    def __repr__(self):
+
+        return '<FitHandle {id}: {status} {pct:.0%}>'.format(id=self.job_id,
+                                                            status=self.status,
+                                                            pct=self.fraction_done)
+
+
+class FitJobManager():
+
+    def __init__(self,
+                 max_processes=None,
+                 output_dir=None):
+
+        # limits the number of cmdstan chain processes across all jobs
+        self.max_processes = max_processes or os.cpu_count()
+        self.output_dir = output_dir
+
+        self.jobs = {}
+
+        self._ids = itertools.count()
+        self._slots = None
+
+    def submit(self,
+               model,
+               choc_rankings,
+               chains=4,
+               iter_warmup=1000,
+               iter_sampling=1000,
+               seed=None,
+               timeout=None,
+               **sampler_args):
+
+        unknown = sorted(set(sampler_args) - set(sampler_arg_names))
+        if unknown:
+            raise ValueError('unsupported sampler arguments {unknown}'.format(unknown=unknown))
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_processes)
+
+        if isinstance(choc_rankings, pd.DataFrame):
+            choc_rankings = ranking_df_to_array(choc_rankings)
+
+        data = make_stan_data(choc_rankings)
+        if 'inits' in sampler_args:
+            sampler_args['inits'] = self._resolve_inits(model, data, chains, seed, sampler_args['inits'])
+
+        handle = FitHandle(next(self._ids), chains)
+
+        run = self._run(handle,
+                        model.exe_file,
+                        data,
+                        chains,
+                        iter_warmup,
+                        iter_sampling,
+                        seed,
+                        sampler_args)
+
+        if timeout is not None:
+            run = asyncio.wait_for(run, timeout)
+
+        handle._task = asyncio.ensure_future(run)
+        handle._task.add_done_callback(lambda _: setattr(handle, 'finished', time.time()))
+
+        self.jobs[handle.job_id] = handle
+
+        return handle
+
+    def _resolve_inits(self,
+                       model,
+                       data,
+                       chains,
+                       seed,
+                       inits):
+
+        # 'data' gives the per chain inits StanModel.fit builds from the
+        # rankings, any other string is an init file passed on to cmdstan
+        if isinstance(inits, str):
+            if inits == 'data':
+                return chain_inits(data,
+                                   chains=chains,
+                                   model=os.path.basename(model.stan_file),
+                                   seed=seed)
+            if not os.path.exists(inits):
+                raise ValueError('inits file {f} not found'.format(f=inits))
+
+        return inits
+
+    def _chain_args(self,
+                    exe_file,
+                    job_dir,
+                    chain,
+                    iter_warmup,
+                    iter_sampling,
+                    seed,
+                    sampler_args):
+
+        args = [exe_file,
+                'sample',
+                'num_samples={n}'.format(n=iter_sampling),
+                'num_warmup={n}'.format(n=iter_warmup),
+                'thin={n}'.format(n=sampler_args.get('thin', 1))]
+
+        if 'adapt_delta' in sampler_args:
+            args += ['adapt', 'delta={d}'.format(d=sampler_args['adapt_delta'])]
+
+        args += ['algorithm=hmc', 'engine=nuts']
+        if 'max_treedepth' in sampler_args:
+            args.append('max_depth={d}'.format(d=sampler_args['max_treedepth']))
+        if 'step_size' in sampler_args:
+            args.append('stepsize={s}'.format(s=sampler_args['step_size']))
+
+        args += ['id={i}'.format(i=chain),
+                 'data', 'file={f}'.format(f=os.path.join(job_dir, 'data.json'))]
+
+        # inits are a number, an init file or a dict, or a list of one per chain
+        inits = sampler_args.get('inits')
+        if isinstance(inits, list):
+            inits = inits[chain - 1]
+
+        if isinstance(inits, (int, float, str)):
+            args.append('init={i}'.format(i=inits))
+        elif inits is not None:
+            init_file = os.path.join(job_dir, 'inits_{i}.json'.format(i=chain))
+            write_stan_json(init_file, inits)
+            args.append('init={f}'.format(f=init_file))
+
+        if seed is not None:
+            args += ['random', 'seed={s}'.format(s=seed)]
+
+        args += ['output',
+                 'file={f}'.format(f=os.path.join(job_dir, 'chain_{i}.csv'.format(i=chain))),
+                 'refresh={r}'.format(r=sampler_args.get('refresh', 100))]
+
+        return args
+
+    async def _run_chain(self,
+                         handle,
+                         chain,
+                         args):
+
+        async with self._slots:
+
+            proc = await asyncio.create_subprocess_exec(*args,
+                                                        stdout=asyncio.subprocess.PIPE,
+                                                        stderr=asyncio.subprocess.STDOUT)
+            try:
+                async for line in proc.stdout:
+                    match = progress_pattern.search(line.decode(errors='replace'))
+                    if match:
+                        handle.progress[chain] = {'iteration': int(match.group(1)),
+                                                  'total': int(match.group(2)),
+                                                  'phase': match.group(3).lower()}
+
+                returncode = await proc.wait()
+            finally:
+                # cancellation and timeouts must not leave cmdstan running
+                if proc.returncode is None:
+                    proc.terminate()
+                    await proc.wait()
+
+        if returncode != 0:
+            raise RuntimeError('chain {c} of job {j} exited with code {r}'.format(c=chain,
+                                                                                 j=handle.job_id,
+                                                                                 r=returncode))
+
+    async def _run(self,
+                   handle,
+                   exe_file,
+                   data,
+                   chains,
+                   iter_warmup,
+                   iter_sampling,
+                   seed,
+                   sampler_args):
+
+        if self.output_dir is None:
+            job_dir = tempfile.mkdtemp(prefix='fit_job_{id}_'.format(id=handle.job_id))
+        else:
+            job_dir = os.path.join(self.output_dir, 'job_{id}'.format(id=handle.job_id))
+            os.makedirs(job_dir, exist_ok=True)
+
+        write_stan_json(os.path.join(job_dir, 'data.json'), data)
+
+        chain_runs = [asyncio.ensure_future(
+                          self._run_chain(handle,
+                                          chain,
+                                          self._chain_args(exe_file,
+                                                           job_dir,
+                                                           chain,
+                                                           iter_warmup,
+                                                           iter_sampling,
+                                                           seed,
+                                                           sampler_args)))
+                      for chain in handle.progress]
+
+        try:
+            await asyncio.gather(*chain_runs)
+        finally:
+            for run in chain_runs:
+                run.cancel()
+            await asyncio.gather(*chain_runs, return_exceptions=True)
+
+        return cmdstanpy.from_csv([os.path.join(job_dir, 'chain_{i}.csv'.format(i=chain))
+                                   for chain in handle.progress])
+
+    async def wait_all(self):
+
+        return await asyncio.gather(*[h._task for h in self.jobs.values()],
+                                    return_exceptions=True)
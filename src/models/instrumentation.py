@@ -0,0 +1,169 @@
+import numpy as np
+
+import os
+import json
+import time
+import resource
+import logging
+from contextlib import contextmanager
+
+from src.models.stan_output import read_elapsed_times
+
+
+logger = logging.getLogger(__name__)
+
+sampler_columns = ['n_leapfrog__', 'treedepth__', 'divergent__', 'stepsize__']
+
+
+def _cpu_times():
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    # cmdstan runs as child processes, their cpu time shows up once waited on
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+
+def peak_rss_mb():
+
+    # ru_maxrss is reported in kilobytes on linux
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+
+
+def effective_sample_size(draws):
+
+    # split-chain ESS with geyer's initial monotone sequence, as in stan,
+    # vectorised over every parameter; draws has shape (chains, draws, params)
+    draws = np.asarray(draws, dtype=np.float64)
+    draws = draws.reshape(draws.shape[0], draws.shape[1], -1)
+
+    n = draws.shape[1] // 2
+    draws = np.concatenate([draws[:, :n], draws[:, n:2 * n]], axis=0)
+    m = draws.shape[0]
+
+    centred = draws - draws.mean(axis=1, keepdims=True)
+    spectrum = np.fft.rfft(centred, n=2 * n, axis=1)
+    acov = np.fft.irfft(spectrum * np.conj(spectrum), n=2 * n, axis=1)[:, :n] / n
+
+    within = (acov[:, 0] * n / (n - 1)).mean(axis=0)
+    between = draws.mean(axis=1).var(axis=0, ddof=1)
+    var_plus = within * (n - 1) / n + between
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rho = 1 - (within - acov.mean(axis=0)) / var_plus
+    rho[0] = 1
+
+    pairs = rho[:2 * (n // 2)].reshape(n // 2, 2, -1).sum(axis=1)
+    positive = np.cumprod(pairs > 0, axis=0).astype(bool)
+    pairs = np.minimum.accumulate(np.where(positive, pairs, np.inf), axis=0)
+
+    tau = -1 + 2 * np.where(positive, pairs, 0).sum(axis=0)
+
+    return m * n / np.maximum(tau, 1 / np.log10(m * n))
+
+
+class FitRecorder():
+
+    def __init__(self):
+
+        self.created = time.time()
+        self.stages = {}
+        self.sampler = {}
+        self.ess = {}
+        self.peak_rss_mb = {}
+
+    @contextmanager
+    def stage(self,
+              name):
+
+        wall = time.perf_counter()
+        cpu, child_cpu = _cpu_times()
+
+        try:
+            yield
+        finally:
+            cpu_end, child_cpu_end = _cpu_times()
+            self.stages[name] = {'wall': time.perf_counter() - wall,
+                                 'cpu': cpu_end - cpu,
+                                 'child_cpu': child_cpu_end - child_cpu}
+
+    def record_sampler(self,
+                       sampler_draws,
+                       csv_files):
+
+        # sampler_draws maps each sampler column to an array of draws
+        self.sampler = {'gradient_evals': int(np.sum(sampler_draws['n_leapfrog__'])),
+                        'treedepth_mean': float(np.mean(sampler_draws['treedepth__'])),
+                        'treedepth_max': int(np.max(sampler_draws['treedepth__'])),
+                        'divergences': int(np.sum(sampler_draws['divergent__'])),
+                        'stepsize': float(np.mean(sampler_draws['stepsize__']))}
+
+        elapsed = [read_elapsed_times(csv_file) for csv_file in csv_files]
+        self.sampler['warmup_seconds'] = [e.get('warmup') for e in elapsed]
+        self.sampler['sampling_seconds'] = [e.get('sampling') for e in elapsed]
+
+    def record_ess(self,
+                   stan_var,
+                   draws,
+                   chains):
+
+        draws = np.asarray(draws)
+        ess = effective_sample_size(draws.reshape(chains, draws.shape[0] // chains, -1))
+
+        # per second of sampling, the slowest chain bounds the wall time
+        sampling_seconds = max([s for s in self.sampler.get('sampling_seconds', []) if s] or
+                               [self.stages.get('sample', {}).get('wall', np.nan)])
+
+        self.ess[stan_var] = {'min': float(ess.min()),
+                              'median': float(np.median(ess)),
+                              'min_per_sec': float(ess.min() / sampling_seconds),
+                              'median_per_sec': float(np.median(ess) / sampling_seconds)}
+
+    def record_peak_rss(self):
+
+        self.peak_rss_mb = peak_rss_mb()
+
+    def to_dict(self):
+
+        return {'created': self.created,
+                'stages': self.stages,
+                'sampler': self.sampler,
+                'ess': self.ess,
+                'peak_rss_mb': self.peak_rss_mb}
+
+    def log(self,
+            level=logging.INFO,
+            **extra):
+
+        # one structured line per fit, easy to grep or ship to a log store
+        logger.log(level, json.dumps(dict(self.to_dict(), **extra), default=float))
+
+    def export(self,
+               path,
+               **extra):
+
+        # appends a json line so repeated fits build up a history to compare
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(json.dumps(dict(self.to_dict(), **extra), default=float) + '\n')
+
+        return path
+
+    def metrics(self):
+
+        # flat name -> value pairs for metrics backends
+        flat = {}
+        for name, stage in self.stages.items():
+            for key, value in stage.items():
+                flat['stage.{name}.{key}'.format(name=name, key=key)] = value
+        for key, value in self.sampler.items():
+            if not isinstance(value, list):
+                flat['sampler.{key}'.format(key=key)] = value
+        for var, ess in self.ess.items():
+            for key, value in ess.items():
+                flat['ess.{var}.{key}'.format(var=var, key=key)] = value
+        for key, value in self.peak_rss_mb.items():
+            flat['peak_rss_mb.{key}'.format(key=key)] = value
+
+        return flat
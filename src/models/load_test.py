@@ -0,0 +1,126 @@
+import click
+import numpy as np
+
+import json
+import time
+import asyncio
+import urllib.request
+from urllib.parse import quote
+
+
+async def _get(reader,
+               writer,
+               host,
+               target):
+
+    writer.write('GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n'.format(target=target,
+                                                                       host=host).encode('latin-1'))
+    await writer.drain()
+
+    status = await reader.readline()
+
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        if key.strip().lower() == 'content-length':
+            length = int(value)
+
+    await reader.readexactly(length)
+
+    return int(status.split()[1])
+
+
+async def _worker(host,
+                  port,
+                  targets,
+                  latencies,
+                  errors):
+
+    reader, writer = await asyncio.open_connection(host, port)
+
+    for target in targets:
+        start = time.perf_counter()
+        status = await _get(reader, writer, host, target)
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors.append(status)
+
+    writer.close()
+
+
+def make_targets(chocs,
+                 n_requests,
+                 n_distinct,
+                 seed=0):
+
+    # a pool of distinct queries sampled with replacement, so repeats hit the
+    # cache; names are quoted as they may hold spaces, & or /
+    rng = np.random.default_rng(seed)
+    pool = []
+
+    for i in range(n_distinct):
+        kind = i % 3
+        if kind == 0:
+            a, b = rng.choice(chocs, size=2, replace=False)
+            pool.append('/pairwise?a={a}&b={b}'.format(a=quote(str(a), safe=''), b=quote(str(b), safe='')))
+        elif kind == 1:
+            pool.append('/top_k?k={k}'.format(k=rng.integers(1, len(chocs) + 1)))
+        else:
+            pool.append('/rank_probs?choc={c}'.format(c=quote(str(rng.choice(chocs)), safe='')))
+
+    return [pool[i] for i in rng.integers(0, len(pool), size=n_requests)]
+
+
+async def run_load_test(host,
+                        port,
+                        targets,
+                        concurrency):
+
+    latencies = []
+    errors = []
+
+    start = time.perf_counter()
+    await asyncio.gather(*[_worker(host, port, targets[i::concurrency], latencies, errors)
+                           for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+
+    return {'requests': len(latencies),
+            'errors': len(errors),
+            'concurrency': concurrency,
+            'requests_per_sec': len(latencies) / elapsed,
+            'p50_ms': np.percentile(latencies, 50),
+            'p99_ms': np.percentile(latencies, 99),
+            'max_ms': latencies.max()}
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8080, type=int)
+@click.option('--requests', 'n_requests', default=10000, type=int)
+@click.option('--distinct', 'n_distinct', default=500, type=int)
+@click.option('--concurrency', default=16, type=int)
+def main(host, port, n_requests, n_distinct, concurrency):
+    """ Load tests a running serve_model server and reports p50/p99 latency.
+    """
+    with urllib.request.urlopen('http://{host}:{port}/fits'.format(host=host, port=port)) as r:
+        fits = json.load(r)
+
+    chocs = next(iter(fits.values()))['chocs']
+
+    results = asyncio.run(run_load_test(host,
+                                        port,
+                                        make_targets(chocs, n_requests, n_distinct),
+                                        concurrency))
+
+    for key, value in results.items():
+        click.echo('{key:>16}: {value:.3f}'.format(key=key, value=value)
+                   if isinstance(value, float) else '{key:>16}: {value}'.format(key=key, value=value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import numpy as np
+from scipy.special import logsumexp
+
+import logging
+
+from src.features.build_features import ranking_df_codes, long_to_positions, thread_pool
+
+logger = logging.getLogger(__name__)
+
+
+def ranking_orders(rankings):
+
+    # orders[p] lists chocolate indices best first, with anything the person
+    # did not rank at the end; n_ranked counts the ranked ones
+    if hasattr(rankings, 'columns'):
+        person_codes, choc_codes, ranks, chocs = ranking_df_codes(rankings)
+        positions = long_to_positions(person_codes, choc_codes, ranks, len(chocs))
+        return (np.argsort(positions, axis=1, kind='stable'),
+                (positions < len(chocs)).sum(axis=1),
+                chocs,
+                np.unique(rankings['person'].to_numpy()))
+
+    orders = np.asarray(rankings)
+    n_people, n_chocs = orders.shape
+
+    return orders, np.full(n_people, n_chocs), np.arange(n_chocs), np.arange(n_people)
+
+
+def _stage_mask(n_ranked,
+                n_chocs):
+
+    # stage s picks the s-th favourite from those left; the last stage of a
+    # complete ranking has one choice left and carries no information
+    return np.arange(n_chocs) < np.minimum(n_ranked, n_chocs - 1)[:, None]
+
+
+def plackett_luce_loglik(log_worths,
+                         orders,
+                         stages):
+
+    # log P(order | cluster) for every cluster and person, shape (clusters, people),
+    # with remaining[k, p, s] the total worth left to choose from at stage s;
+    # worths are scaled by the largest so the reverse cumsum cannot overflow
+    worths = np.exp(log_worths - log_worths.max(axis=1, keepdims=True))
+    ordered = worths[:, orders]
+    remaining = np.cumsum(ordered[..., ::-1], axis=-1)[..., ::-1]
+
+    return np.log(np.where(stages, ordered / remaining, 1)).sum(axis=-1), remaining
+
+
+class PlackettLuceMixture():
+
+    def __init__(self,
+                 n_clusters=3,
+                 n_init=5,
+                 max_iter=200,
+                 tol=1e-6,
+                 prior=0.01,
+                 chunk_size=100000,
+                 n_jobs=None,
+                 seed=0):
+
+        # prior is a pseudo-count pulling every worth towards one, so a
+        # chocolate nobody in a cluster picks keeps a finite log worth
+        self.n_clusters = n_clusters
+        self.n_init = n_init
+        self.max_iter = max_iter
+        self.tol = tol
+        self.prior = prior
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self.seed = seed
+
+    def _chunk_stats(self,
+                     log_worths,
+                     log_weights,
+                     orders,
+                     positions,
+                     stages,
+                     chosen):
+
+        # one pass over a chunk gives the e-step responsibilities and the
+        # minorise-maximise sufficient statistics of hunter (2004)
+        loglik, remaining = plackett_luce_loglik(log_worths, orders, stages)
+        joint = loglik + log_weights[:, None]
+        total = logsumexp(joint, axis=0)
+        resp = np.exp(joint - total)
+
+        # every chocolate still left at a stage is charged 1 / (worth left),
+        # summed over the stages it survives and gathered back to chocolate order
+        charged = np.cumsum(np.where(stages, 1 / remaining, 0), axis=-1)
+        charged = np.take_along_axis(charged, positions[None], axis=-1)
+
+        return (total.sum(),
+                resp,
+                resp @ chosen,
+                np.einsum('kp,kpc->kc', resp, charged))
+
+    def _em(self,
+            orders,
+            positions,
+            stages,
+            chosen,
+            rng,
+            pool):
+
+        n_people, n_chocs = orders.shape
+
+        log_worths = rng.normal(0, 1, size=(self.n_clusters, n_chocs))
+        log_weights = np.full(self.n_clusters, -np.log(self.n_clusters))
+
+        chunks = [slice(start, start + self.chunk_size) for start in range(0, n_people, self.chunk_size)]
+        resp = np.empty((self.n_clusters, n_people))
+
+        previous = -np.inf
+        for n_iter in range(1, self.max_iter + 1):
+
+            def chunk_stats(rows):
+                return self._chunk_stats(log_worths, log_weights, orders[rows], positions[rows], stages[rows], chosen[rows])
+
+            stats = list(pool.map(chunk_stats, chunks))
+
+            loglik = sum(s[0] for s in stats)
+            for rows, s in zip(chunks, stats):
+                resp[:, rows] = s[1]
+            picks = sum(s[2] for s in stats)
+            exposure = sum(s[3] for s in stats)
+
+            log_worths = np.log(picks + self.prior) - np.log(exposure + self.prior)
+            log_worths -= log_worths.mean(axis=1, keepdims=True)
+            log_weights = np.log(resp.sum(axis=1) + 1e-12) - np.log(n_people)
+
+            converged = abs(loglik - previous) <= self.tol * abs(loglik)
+            previous = loglik
+            if converged:
+                break
+
+        return {'loglik': loglik,
+                'log_worths': log_worths,
+                'log_weights': log_weights,
+                'resp': resp,
+                'n_iter': n_iter,
+                'converged': converged}
+
+    def fit(self,
+            rankings):
+
+        orders, n_ranked, self.chocs, self.people = ranking_orders(rankings)
+        stages = _stage_mask(n_ranked, orders.shape[1])
+
+        # positions[p, c] is where chocolate c sits in person p's order, and
+        # chosen[p, c] whether it was picked at an informative stage
+        positions = np.argsort(orders, axis=1)
+        chosen = np.take_along_axis(stages, positions, axis=1).astype(float)
+
+        seeds = np.random.SeedSequence(self.seed).spawn(self.n_init)
+
+        best = None
+        with thread_pool(self.n_jobs) as pool:
+            for restart, seed_seq in enumerate(seeds):
+                run = self._em(orders, positions, stages, chosen, np.random.default_rng(seed_seq), pool)
+                logger.info('restart {r}: log likelihood {ll:.1f} after {n} iterations'.format(r=restart,
+                                                                                              ll=run['loglik'],
+                                                                                              n=run['n_iter']))
+                if best is None or run['loglik'] > best['loglik']:
+                    best = run
+
+        # clusters are reported largest first
+        order = np.argsort(-best['log_weights'])
+
+        self.log_likelihood = best['loglik']
+        self.n_iter = best['n_iter']
+        self.converged = best['converged']
+        self.weights = np.exp(best['log_weights'][order])
+        self.log_worths = best['log_worths'][order]
+        self.memberships = best['resp'][order].T
+        self.labels = self.memberships.argmax(axis=1)
+
+        return self
+
+    @property
+    def orderings(self):
+
+        # chocolates of each cluster from most to least preferred
+        return self.chocs[np.argsort(-self.log_worths, axis=1)]
+
+    def predict_proba(self,
+                      rankings):
+
+        orders, n_ranked, _, _ = ranking_orders(rankings)
+        loglik, _ = plackett_luce_loglik(self.log_worths, orders, _stage_mask(n_ranked, orders.shape[1]))
+        joint = loglik + np.log(self.weights)[:, None]
+
+        return np.exp(joint - logsumexp(joint, axis=0)).T
+
+    def predict(self,
+                rankings):
+
+        return self.predict_proba(rankings).argmax(axis=1)
@@ -0,0 +1,143 @@
+import numpy as np
+
+from src.features.build_features import as_ranking_index
+from src.models.predict_model import load_posterior
+
+
+def replicate_ranks(mus,
+                    sigmas,
+                    n_people,
+                    rng):
+
+    # ranks[d, p, c] is the rank, 0 = favourite, that replicated person p gives
+    # chocolate c under draw d
+    ratings = mus[:, None, :] + sigmas[:, None, :] * rng.standard_normal((mus.shape[0], n_people, mus.shape[1]))
+
+    return np.argsort(np.argsort(-ratings, axis=2), axis=2)
+
+
+def replicate_stats(ranks,
+                    n,
+                    max_rank=None):
+
+    n_draws, n_people, n_chocs = ranks.shape
+
+    # bottom n counts the same rank slots as RankingIndex.bottom_n, which
+    # counts back from the lowest rank anyone gave
+    if max_rank is None:
+        max_rank = n_chocs - 1
+
+    cells = (np.arange(n_draws)[:, None, None] * n_chocs + np.arange(n_chocs)) * n_chocs + ranks
+    rank_hist = np.bincount(cells.ravel(), minlength=n_draws * n_chocs * n_chocs).reshape(n_draws, n_chocs, n_chocs)
+
+    # wins[d, a, b] counts replicated people ranking a above b, built one
+    # chocolate at a time so memory stays at draws x people x chocolates
+    wins = np.empty((n_draws, n_chocs, n_chocs))
+    for a in range(n_chocs):
+        wins[:, a] = (ranks[:, :, a, None] < ranks).sum(axis=1)
+
+    return {'rank_hist': rank_hist,
+            'mean_rank': ranks.mean(axis=1),
+            'top_n': rank_hist[:, :, :n].sum(axis=2),
+            'bottom_n': rank_hist[:, :, max(max_rank - n, 0):max_rank + 1].sum(axis=2),
+            'win_rates': wins / n_people}
+
+
+def _summary(observed,
+             replicated,
+             alpha):
+
+    # lower / upper bound the replicated statistic, which need not contain the
+    # observed one, so there is no bootstrap style estimate and viz_rankings
+    # draws them as a separate range rather than error bars on the observed bars
+    lower, upper = np.quantile(replicated, [alpha / 2, 1 - alpha / 2], axis=0)
+
+    return {'observed': observed,
+            'lower': lower,
+            'upper': upper,
+            'mean': replicated.mean(axis=0),
+            'ppp': (replicated >= observed).mean(axis=0)}
+
+
+def _align(posterior,
+           chocs):
+
+    # posterior columns reordered to the chocolates of the observed index
+    mus = np.asarray(posterior['choc_mus_adj'], dtype=np.float64)
+    sigmas = np.asarray(posterior['choc_sigmas_fitted'], dtype=np.float64)
+
+    if 'chocs' in posterior:
+        order = {str(c): i for i, c in enumerate(posterior['chocs'])}
+        columns = np.array([order[str(c)] for c in chocs])
+        mus, sigmas = mus[:, columns], sigmas[:, columns]
+
+    return mus, sigmas
+
+
+vector_stats = ('mean_rank', 'top_n', 'bottom_n')
+matrix_stats = ('rank_hist', 'win_rates')
+
+
+def posterior_predictive(posterior,
+                         observed,
+                         n=5,
+                         alpha=0.05,
+                         max_draws=None,
+                         max_elements=10 ** 7,
+                         seed=0):
+
+    # one replicated ranking matrix the size of the observed data per draw,
+    # summarised chunk by chunk so only the statistics are kept
+    if isinstance(posterior, str):
+        posterior = load_posterior(posterior)
+
+    index = as_ranking_index(observed)
+    n_people = index.n_people
+
+    mus, sigmas = _align(posterior, index.chocs)
+    n_draws, n_chocs = mus.shape
+
+    if max_draws is not None and max_draws < n_draws:
+        keep = np.linspace(0, n_draws - 1, max_draws).astype(int)
+        mus, sigmas, n_draws = mus[keep], sigmas[keep], max_draws
+
+    observed_stats = {'rank_hist': index.rank_hist,
+                      'mean_rank': index.mean_rank,
+                      'top_n': index.top_n(n),
+                      'bottom_n': index.bottom_n(n),
+                      'win_rates': index.win_rates}
+
+    rng = np.random.default_rng(seed)
+    chunk_size = max(1, max_elements // (n_people * n_chocs))
+
+    # per chocolate statistics are kept for every draw to give intervals,
+    # the chocolate x chocolate ones are accumulated to keep memory bounded
+    replicated = {stat: np.empty((n_draws, n_chocs)) for stat in vector_stats}
+    sums = {stat: np.zeros((n_chocs, n_chocs)) for stat in matrix_stats}
+    squares = {stat: np.zeros((n_chocs, n_chocs)) for stat in matrix_stats}
+    exceed = {stat: np.zeros((n_chocs, n_chocs)) for stat in matrix_stats}
+
+    for start in range(0, n_draws, chunk_size):
+        draws = slice(start, min(start + chunk_size, n_draws))
+        stats = replicate_stats(replicate_ranks(mus[draws], sigmas[draws], n_people, rng), n, index.max_rank)
+
+        for stat in vector_stats:
+            replicated[stat][draws] = stats[stat]
+        for stat in matrix_stats:
+            sums[stat] += stats[stat].sum(axis=0)
+            squares[stat] += (stats[stat] ** 2).sum(axis=0)
+            exceed[stat] += (stats[stat] >= observed_stats[stat]).sum(axis=0)
+
+    results = {stat: _summary(observed_stats[stat], replicated[stat], alpha) for stat in vector_stats}
+
+    for stat in matrix_stats:
+        mean = sums[stat] / n_draws
+        results[stat] = {'observed': observed_stats[stat],
+                         'mean': mean,
+                         'sd': np.sqrt(np.maximum(squares[stat] / n_draws - mean ** 2, 0)),
+                         'ppp': exceed[stat] / n_draws}
+
+    return dict(results,
+                chocs=index.chocs,
+                n=n,
+                n_draws=n_draws)
@@ -0,0 +1,176 @@
+import numpy as np
+from scipy.special import ndtr
+
+import os
+from functools import lru_cache
+
+# kept free of pandas, plotly, cmdstanpy and import time git lookups so
+# fitted models can be served from outside the repo
+
+
+@lru_cache(maxsize=None)
+def posterior_dir():
+
+    # only needed to resolve posteriors by name
+    import git
+    git_root = git.Repo(search_parent_directories=True).git.rev_parse("--show-toplevel")
+
+    return os.path.join(git_root, 'models')
+
+
+def posterior_path(name):
+
+    return os.path.join(posterior_dir(), '{name}.npz'.format(name=name))
+
+
+def load_posterior(path):
+
+    if not os.path.exists(path):
+        path = posterior_path(path)
+
+    with np.load(path, allow_pickle=False) as posterior:
+        return {key: posterior[key] for key in posterior.files}
+
+
+class PreferencePredictor():
+
+    def __init__(self,
+                 posterior,
+                 n_rank_sims=50,
+                 chunk_size=250,
+                 seed=0):
+
+        # person ratings are normal(choc_mus_adj, choc_sigmas_fitted) in choc_model.stan
+        self.mus = np.asarray(posterior['choc_mus_adj'], dtype=np.float64)
+        self.sigmas = np.asarray(posterior['choc_sigmas_fitted'], dtype=np.float64)
+        self.n_draws, self.n_chocs = self.mus.shape
+
+        if 'chocs' in posterior:
+            self.chocs = [str(c) for c in posterior['chocs']]
+        else:
+            self.chocs = [str(c) for c in range(self.n_chocs)]
+
+        self.choc_idx = {choc: i for i, choc in enumerate(self.chocs)}
+
+        self.n_rank_sims = n_rank_sims
+        self.chunk_size = chunk_size
+        self.rng = np.random.default_rng(seed)
+
+        self._build_cache()
+
+    @classmethod
+    def from_file(cls,
+                  path,
+                  **kwargs):
+
+        return cls(load_posterior(path), **kwargs)
+
+    def _draw_chunks(self):
+
+        for start in range(0, self.n_draws, self.chunk_size):
+            yield slice(start, start + self.chunk_size)
+
+    def pairwise_draws(self,
+                       draws=slice(None)):
+
+        # P(rating_a > rating_b) for every draw, shape (draws, n_chocs, n_chocs)
+        mus = self.mus[draws]
+        sigmas = self.sigmas[draws]
+
+        diff = mus[:, :, None] - mus[:, None, :]
+        scale = np.sqrt(sigmas[:, :, None] ** 2 + sigmas[:, None, :] ** 2)
+
+        return ndtr(diff / scale)
+
+    def simulate_ratings(self,
+                         n_sims,
+                         draws=slice(None)):
+
+        mus = self.mus[draws]
+        sigmas = self.sigmas[draws]
+
+        return mus[:, None, :] + sigmas[:, None, :] * self.rng.standard_normal((mus.shape[0], n_sims, self.n_chocs))
+
+    def _build_cache(self):
+
+        pairwise = np.zeros((self.n_chocs, self.n_chocs))
+        rank_counts = np.zeros(self.n_chocs * self.n_chocs)
+
+        for draws in self._draw_chunks():
+
+            pairwise += self.pairwise_draws(draws).sum(axis=0)
+
+            # rank of every chocolate for simulated new respondents, 0 = favourite
+            ratings = self.simulate_ratings(self.n_rank_sims, draws).reshape(-1, self.n_chocs)
+            ranks = np.argsort(np.argsort(-ratings, axis=1), axis=1)
+
+            rank_counts += np.bincount((np.arange(self.n_chocs) * self.n_chocs + ranks).ravel(),
+                                       minlength=self.n_chocs * self.n_chocs)
+
+        self.pairwise = pairwise / self.n_draws
+        np.fill_diagonal(self.pairwise, 0.5)
+
+        self.rank_probs = rank_counts.reshape(self.n_chocs, self.n_chocs) / (self.n_draws * self.n_rank_sims)
+        self.top_k_probs = np.cumsum(self.rank_probs, axis=1)
+        self.expected_rank = self.rank_probs @ np.arange(self.n_chocs)
+
+    def to_idx(self,
+               chocs):
+
+        chocs = np.atleast_1d(chocs)
+
+        # negative codes would otherwise wrap round to the last chocolates
+        if chocs.dtype.kind in 'iu':
+            if np.any((chocs < 0) | (chocs >= self.n_chocs)):
+                raise ValueError('chocolate codes must be between 0 and {n}'.format(n=self.n_chocs - 1))
+            return chocs
+
+        unknown = [str(c) for c in chocs if str(c) not in self.choc_idx]
+        if unknown:
+            raise KeyError('unknown chocolates {unknown}'.format(unknown=unknown))
+
+        return np.array([self.choc_idx[str(c)] for c in chocs], dtype=int)
+
+    def prob_prefers(self,
+                     a,
+                     b):
+
+        # P(a new person prefers a over b), vectorised over pairs of a and b
+        return self.pairwise[self.to_idx(a), self.to_idx(b)]
+
+    def rank_distribution(self,
+                          chocs=None):
+
+        if chocs is None:
+            return self.rank_probs
+
+        return self.rank_probs[self.to_idx(chocs)]
+
+    def top_k_batch(self,
+                    ks,
+                    n=None,
+                    excludes=None):
+
+        # chocolates most likely to be in a new person's top k, one query per k
+        ks = np.atleast_1d(ks)
+        n = int(ks.max()) if n is None else n
+
+        scores = self.top_k_probs[:, ks - 1].T.copy()
+
+        if excludes is not None:
+            for row, exclude in enumerate(excludes):
+                if exclude is not None and len(exclude) > 0:
+                    scores[row, self.to_idx(exclude)] = -np.inf
+
+        idx = np.argsort(-scores, axis=1, kind='stable')[:, :n]
+        top_scores = np.take_along_axis(scores, idx, axis=1)
+
+        return [[(self.chocs[i], float(p)) for i, p in zip(row_idx, row_scores) if np.isfinite(p)]
+                for row_idx, row_scores in zip(idx, top_scores)]
+
+    def top_k(self,
+              k,
+              n=None,
+              exclude=None):
+
+        return self.top_k_batch([k], n=k if n is None else n, excludes=[exclude])[0]
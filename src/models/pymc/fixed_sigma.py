@@ -1,37 +1,145 @@
-with pm.Model() as model:
-
-    choc_sigmas_fitted = pm.Gamma("choc_sigmas_fitted",
-                                        alpha=5,
-                                        beta=10,
-                                        shape=(n_chocs))
-    
-    # overall distribution of mean preference values for chocolates
-    choc_mus_fitted = pm.Normal("choc_mus_fitted",
-                            0,
-                            1,
-                            shape=(n_chocs))
-
-    # calculate standard deviation of fitted mu values to normalise scale of person ratings
-    choc_mus_std = pm.Deterministic("choc_mus_std",
-                                    pt.std(choc_mus_fitted))
-
-    choc_mus_mean = pm.Deterministic("choc_mus_mean",
-                                pt.mean(choc_mus_fitted))
-
-    # map order of chocolate mus to individual ranks for use in ordered transform
-    choc_mus_mapped = pm.Deterministic("choc_mus_mapped",
-                                        (choc_mus_fitted[choc_rankings_true])/choc_mus_std)
-
-    # map order of chocolate sigmas to individual ranks for use in ordered transform
-    choc_sigmas_mapped = pm.Deterministic("choc_sigmas_mapped",
-                                            choc_sigmas_fitted[choc_rankings_true])
-
-    #individual distributions of preferences across chocolates, hierarchically related to overall means      
-    person_ratings = pm.Normal("person_ratings",
-                                choc_mus_mapped,
-                                0.2,
-                                transform=pm.distributions.transforms.univariate_ordered,
-                                initval=np.repeat(np.linspace(-2,2,num=n_chocs)[None,:], n_people, axis=0),
-                                shape=(n_people, n_chocs))
-    
-    idata = pm.sample(draws=200)
\ No newline at end of file
+import numpy as np
+import pymc as pm
+import pytensor.tensor as pt
+from pymc.sampling.jax import sample_numpyro_nuts
+
+from src.models.stan_models import RankingModelMixin, make_stan_data, chain_inits
+from src.models.instrumentation import FitRecorder, sampler_columns
+
+# numpyro sample stats under the names cmdstan gives its sampler columns
+sampler_stat_names = {'n_leapfrog__': 'n_steps',
+                      'treedepth__': 'tree_depth',
+                      'divergent__': 'diverging',
+                      'stepsize__': 'step_size'}
+
+
+def build_model(rankings,
+                fixed_sigma=0.2):
+
+    # rankings are the flipped (least preferred first) rows from make_stan_data,
+    # so position k of each ordered person rating belongs to chocolate rankings[i, k]
+    n_people, n_chocs = rankings.shape
+
+    with pm.Model() as model:
+
+        choc_sigmas_alpha = pm.Gamma("choc_sigmas_alpha", alpha=5, beta=1)
+        choc_sigmas_mean = pm.Gamma("choc_sigmas_mean", alpha=10, beta=4)
+
+        choc_sigmas_fitted = pm.Gamma("choc_sigmas_fitted",
+                                      alpha=choc_sigmas_alpha,
+                                      beta=choc_sigmas_alpha / choc_sigmas_mean,
+                                      shape=(n_chocs))
+
+        # overall distribution of mean preference values for chocolates
+        choc_mus_fitted = pm.Normal("choc_mus_fitted",
+                                    0,
+                                    1,
+                                    shape=(n_chocs))
+
+        # standardise with the sample sd, as sd() does in choc_model.stan
+        choc_mus_std = pm.Deterministic("choc_mus_std",
+                                        pt.sqrt(pt.var(choc_mus_fitted) * n_chocs / (n_chocs - 1)))
+
+        choc_mus_adj = pm.Deterministic("choc_mus_adj",
+                                        choc_mus_fitted / choc_mus_std)
+
+        # person rating sds are either the fitted per chocolate sds or held fixed
+        if fixed_sigma is None:
+            person_sigmas = choc_sigmas_fitted[rankings]
+        else:
+            person_sigmas = fixed_sigma
+
+        #individual distributions of preferences across chocolates, hierarchically related to overall means
+        pm.Normal("ratings",
+                  choc_mus_adj[rankings],
+                  person_sigmas,
+                  transform=pm.distributions.transforms.univariate_ordered,
+                  initval=np.repeat(np.linspace(-2,2,num=n_chocs)[None,:], n_people, axis=0),
+                  shape=(n_people, n_chocs))
+
+    return model
+
+
+class PymcModel(RankingModelMixin):
+
+    def __init__(self,
+                 fixed_sigma=0.2,
+                 plot_config={'height': 600,
+                              'width': 1000}):
+
+        # fixed_sigma=None fits the same model as choc_model.stan
+        self.fixed_sigma = fixed_sigma
+        self.name = 'pymc_fixed_sigma' if fixed_sigma is not None else 'pymc_fitted_sigma'
+
+        self.plot_config = plot_config
+
+    def fit(self,
+            choc_rankings,
+            chains=4,
+            iter_warmup=1000,
+            iter_sampling=1000,
+            adapt_delta=0.8,
+            seed=None,
+            inits=None,
+            ess_vars=('choc_mus_fitted', 'choc_sigmas_fitted'),
+            **kwargs):
+
+        # sampler arguments use the cmdstanpy names so fits can be swapped with StanModel
+        self.fit_stats = FitRecorder()
+
+        with self.fit_stats.stage('data'):
+            choc_rankings_array = self._read_rankings(choc_rankings)
+
+            self.data = make_stan_data(choc_rankings_array)
+
+            # the same ranking-derived inits as StanModel.fit(inits='data')
+            if isinstance(inits, str) and inits == 'data':
+                inits = chain_inits(self.data, chains=chains, seed=seed)
+
+        with self.fit_stats.stage('compile'):
+            self.model = build_model(self.data['rankings'], fixed_sigma=self.fixed_sigma)
+
+        # chains are vectorised within one process, the jax jit happens on the first call
+        with self.fit_stats.stage('sample'):
+            self.fit = sample_numpyro_nuts(draws=iter_sampling,
+                                           tune=iter_warmup,
+                                           chains=chains,
+                                           target_accept=adapt_delta,
+                                           random_seed=seed,
+                                           initvals=inits,
+                                           chain_method='vectorized',
+                                           progressbar=False,
+                                           model=self.model,
+                                           **kwargs)
+
+        self.chains = chains
+        self._record_fit_stats(ess_vars)
+
+    def _record_fit_stats(self,
+                          ess_vars):
+
+        self.fit_stats.record_sampler({col: self.get_stan_variable(col) for col in sampler_columns}, [])
+
+        for stan_var in ess_vars:
+            self.fit_stats.record_ess(stan_var,
+                                      self.get_stan_variable(stan_var),
+                                      self.chains)
+
+        self.fit_stats.record_peak_rss()
+        self.fit_stats.log(model=self.name,
+                           n_people=int(self.data['n_people']))
+
+    def get_stan_variable(self,
+                          stan_var):
+
+        # draws stacked chain by chain, matching CmdStanMCMC.stan_variable
+        if stan_var in sampler_columns:
+            stats = self.fit.sample_stats
+            stat = sampler_stat_names[stan_var]
+            if stat not in stats:
+                return np.full(stats['diverging'].shape, np.nan).reshape(-1)
+            return stats[stat].to_numpy().reshape(-1)
+
+        draws = self.fit.posterior[stan_var].to_numpy()
+
+        return draws.reshape(-1, *draws.shape[2:])
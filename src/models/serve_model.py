@@ -0,0 +1,244 @@
+import click
+import logging
+
+import os
+import json
+import asyncio
+from functools import lru_cache
+from urllib.parse import urlsplit, parse_qsl
+
+from src.models.predict_model import PreferencePredictor
+from src.models.adaptive import AdaptiveSurvey, max_subset_size
+
+
+logger = logging.getLogger(__name__)
+
+
+class ScoringService():
+
+    def __init__(self,
+                 fits,
+                 cache_size=4096):
+
+        # fits maps a name to a saved posterior path
+        self.predictors = {name: PreferencePredictor.from_file(path) for name, path in fits.items()}
+        self.surveys = {}
+
+        self.query = lru_cache(maxsize=cache_size)(self._query)
+
+        self.routes = {'/fits': self.fits,
+                       '/pairwise': self.pairwise,
+                       '/top_k': self.top_k,
+                       '/rank_probs': self.rank_probs,
+                       '/next_question': self.next_question}
+
+    def _predictor(self,
+                   params):
+
+        name = params.get('fit', next(iter(self.predictors)))
+        if name not in self.predictors:
+            raise KeyError('unknown fit {name}'.format(name=name))
+
+        return self.predictors[name]
+
+    def fits(self,
+             params):
+
+        return {name: {'chocs': p.chocs, 'n_draws': p.n_draws} for name, p in self.predictors.items()}
+
+    def pairwise(self,
+                 params):
+
+        predictor = self._predictor(params)
+        a = params['a'].split(',')
+        b = params['b'].split(',')
+        if len(a) != len(b):
+            raise ValueError('a and b must list the same number of chocolates')
+
+        return {'a': a, 'b': b, 'prob': predictor.prob_prefers(a, b).tolist()}
+
+    def top_k(self,
+              params):
+
+        predictor = self._predictor(params)
+        k = int(params.get('k', 3))
+        n = int(params['n']) if 'n' in params else None
+        if not 1 <= k <= predictor.n_chocs:
+            raise ValueError('k must be between 1 and {n}'.format(n=predictor.n_chocs))
+        if n is not None and n < 1:
+            raise ValueError('n must be at least 1')
+        exclude = params['exclude'].split(',') if params.get('exclude') else None
+
+        return {'k': k, 'top_k': predictor.top_k(k, n=n, exclude=exclude)}
+
+    def rank_probs(self,
+                   params):
+
+        predictor = self._predictor(params)
+        chocs = params['choc'].split(',') if params.get('choc') else predictor.chocs
+
+        return {'chocs': chocs, 'rank_probs': predictor.rank_distribution(chocs).tolist()}
+
+    def next_question(self,
+                      params):
+
+        # answers so far come as winner>loser pairs, e.g. answers=mars>twix,bounty>snickers
+        name = params.get('fit', next(iter(self.predictors)))
+        predictor = self._predictor(params)
+        k = int(params.get('k', 2))
+        if not 2 <= k <= min(predictor.n_chocs, max_subset_size):
+            raise ValueError('k must be between 2 and {n}'.format(n=min(predictor.n_chocs, max_subset_size)))
+        if name not in self.surveys:
+            self.surveys[name] = AdaptiveSurvey(predictor)
+
+        answers = [answer.split('>') for answer in params['answers'].split(',')] if params.get('answers') else []
+        if any(len(answer) != 2 for answer in answers):
+            raise ValueError('answers must be winner>loser pairs')
+
+        return self.surveys[name].next_subset(k, answers=answers)
+
+    def _query(self,
+               path,
+               params):
+
+        if path not in self.routes:
+            return 404, {'error': 'unknown path {path}'.format(path=path)}
+
+        try:
+            return 200, self.routes[path](dict(params))
+        except (KeyError, ValueError, IndexError) as e:
+            # str() of a KeyError is the repr of its message
+            return 400, {'error': str(e.args[0]) if e.args else repr(e)}
+
+    def handle(self,
+               target):
+
+        url = urlsplit(target)
+
+        # parameters are sorted so equivalent queries share a cache entry
+        return self.query(url.path.rstrip('/') or '/', tuple(sorted(parse_qsl(url.query))))
+
+
+async def _read_request(reader):
+
+    request_line = await reader.readline()
+    if not request_line:
+        return None, None
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+
+    return request_line.decode('latin-1').split(), headers
+
+
+def _response(status,
+              body,
+              keep_alive):
+
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+              500: 'Internal Server Error'}[status]
+    payload = json.dumps(body).encode()
+
+    head = ('HTTP/1.1 {status} {reason}\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: {length}\r\n'
+            'Connection: {connection}\r\n\r\n').format(status=status,
+                                                       reason=reason,
+                                                       length=len(payload),
+                                                       connection='keep-alive' if keep_alive else 'close')
+
+    return head.encode('latin-1') + payload
+
+
+def make_handler(service):
+
+    async def handle_connection(reader, writer):
+
+        try:
+            while True:
+                request, headers = await _read_request(reader)
+                if not request:
+                    break
+
+                method, target, version = (request + ['HTTP/1.0'])[:3]
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version == 'HTTP/1.1')
+
+                if method != 'GET':
+                    status, body = 405, {'error': 'only GET is supported'}
+                else:
+                    # an unexpected error still gets a response rather than
+                    # a closed socket
+                    try:
+                        status, body = service.handle(target)
+                    except Exception as e:
+                        logger.exception('error handling {target}'.format(target=target))
+                        status, body = 500, {'error': repr(e)}
+
+                writer.write(_response(status, body, keep_alive))
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return handle_connection
+
+
+async def serve(service,
+                host='127.0.0.1',
+                port=8080):
+
+    server = await asyncio.start_server(make_handler(service), host, port)
+
+    logger.info('serving {fits} on http://{host}:{port}'.format(fits=list(service.predictors),
+                                                               host=host,
+                                                               port=port))
+
+    async with server:
+        await server.serve_forever()
+
+
+def parse_fit_option(fit):
+
+    # either name=path or a path whose file name becomes the fit name
+    name, sep, path = fit.partition('=')
+    if not sep:
+        path = fit
+        name = os.path.splitext(os.path.basename(fit))[0]
+
+    return name, path
+
+
+@click.command()
+@click.option('--fit', 'fits', multiple=True, required=True,
+              help='saved posterior as name=path or path, can be repeated')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8080, type=int)
+@click.option('--cache-size', default=4096, type=int)
+def main(fits, host, port, cache_size):
+    """ Serves pairwise, top-k and rank probability queries for saved
+        posteriors (see StanModel.save_posterior) over HTTP.
+    """
+    service = ScoringService(dict(parse_fit_option(fit) for fit in fits),
+                             cache_size=cache_size)
+
+    asyncio.run(serve(service, host=host, port=port))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -1,18 +1,206 @@
 import numpy as np
 import pandas as pd
-import plotly.express as px
-from plotly.subplots import make_subplots
-import plotly.graph_objects as go
+from scipy.special import ndtri, log_ndtr
 
 import os
-from cmdstanpy import CmdStanModel
+import tempfile
+from cmdstanpy import CmdStanModel, write_stan_json
+
+from src.models.stan_output import DrawStreamer, load_stan_variable
+from src.models.instrumentation import FitRecorder, sampler_columns
+from src.visualization.visualize import plot_samples_violin, plot_pop_ranking_samples
 
 import git
 git_root = git.Repo(search_parent_directories=True).git.rev_parse("--show-toplevel")
 
 stan_model_dir = os.path.join(git_root, 'src', 'models', 'stan')
 
-class StanModel(CmdStanModel):
+# choc_model_nc has the posterior of choc_model, sampled with non-centered
+# latents and chocolate sds and without rescaling the means by their sd
+model_files = {'choc_model': 'choc_model.stan',
+               'choc_model_nc': 'choc_model_nc.stan',
+               'choc_model_segments': 'choc_model_segments.stan'}
+
+# sampler columns cmdstan writes ahead of the model variables
+method_columns = ['lp__', 'accept_stat__', 'stepsize__', 'treedepth__', 'n_leapfrog__', 'divergent__', 'energy__']
+
+def ranking_df_to_array(ranking_df):
+
+    # one row per person, chocolates ordered from most to least preferred
+    n_people = ranking_df['person'].nunique()
+
+    return (ranking_df.sort_values(['person_idx', 'rank'])['choc_idx'].
+            to_numpy().
+            reshape(n_people, -1))
+
+def ranking_df_to_segments(ranking_df):
+
+    # segment_idx per person, in the row order of ranking_df_to_array
+    segments = ranking_df.groupby('person_idx')['segment_idx'].first().to_numpy()
+
+    if np.any(segments < 0):
+        raise ValueError('every person needs a segment to fit a segment model')
+
+    return segments
+
+def make_stan_data(choc_rankings_array,
+                   segments=None):
+
+    stan_data = {'n_people': choc_rankings_array.shape[0],
+                 'n_chocs': choc_rankings_array.shape[1],
+                 'rankings': np.flip(choc_rankings_array, axis=1).astype('int')}
+
+    # models without segments ignore the extra data
+    if segments is not None:
+        stan_data['n_segments'] = int(np.max(segments)) + 1
+        stan_data['segment'] = np.asarray(segments).astype('int') + 1
+
+    return stan_data
+
+def normal_scores(n_chocs):
+
+    # blom scores for ranks 1..n, ascending to match the ordered ratings
+    return ndtri((np.arange(1, n_chocs + 1) - 0.375) / (n_chocs + 0.25))
+
+def data_inits(stan_data):
+
+    # ratings start at the normal scores of each person's ranks and the
+    # chocolate parameters at the mean and sd of the scores they were given
+    rankings = np.asarray(stan_data['rankings'])
+    n_people, n_chocs = rankings.shape
+
+    scores = np.broadcast_to(normal_scores(n_chocs), (n_people, n_chocs))
+
+    counts = np.bincount(rankings.ravel(), minlength=n_chocs)[:n_chocs]
+    sums = np.bincount(rankings.ravel(), weights=scores.ravel(), minlength=n_chocs)[:n_chocs]
+    squares = np.bincount(rankings.ravel(), weights=scores.ravel() ** 2, minlength=n_chocs)[:n_chocs]
+
+    mus = sums / np.maximum(counts, 1)
+    sigmas = np.sqrt(np.maximum(squares / np.maximum(counts, 1) - mus ** 2, 0))
+    sigmas = np.where(counts > 1, np.maximum(sigmas, 0.1), 1.0)
+
+    return {'ratings': np.array(scores),
+            'choc_mus_fitted': mus,
+            'choc_sigmas_fitted': sigmas}
+
+def _model_inits(inits,
+                 model,
+                 rankings):
+
+    # converts the shared inits to the parameters each model declares
+    mus, sigmas = inits['choc_mus_fitted'], inits['choc_sigmas_fitted']
+    sigmas_mean = sigmas.mean()
+    sigmas_alpha = np.clip(sigmas_mean ** 2 / max(sigmas.var(), 1e-6), 1, 50)
+
+    if model.startswith('choc_model_nc'):
+        n_chocs = len(mus)
+        j = np.arange(1, n_chocs)
+        basis = np.triu(np.ones((n_chocs, n_chocs - 1))) / np.sqrt(j * (j + 1))
+        basis[j, j - 1] = -j / np.sqrt(j * (j + 1))
+
+        mus_adj = mus / mus.std(ddof=1)
+        direction = basis.T @ (mus_adj - mus_adj.mean())
+
+        # ratings_u inverts the truncated inverse cdfs of choc_model_nc.stan,
+        # mapping each person's ratings through the normal of the chocolate in that slot
+        slot_mus, slot_sigmas = mus_adj[rankings], sigmas[rankings]
+        ratings = inits['ratings']
+        log_upper = log_ndtr(-(ratings - slot_mus) / slot_sigmas)
+        log_tail = np.zeros_like(ratings)
+        log_tail[:, 1:] = log_ndtr(-(ratings[:, :-1] - slot_mus[:, 1:]) / slot_sigmas[:, 1:])
+        ratings_u = -np.expm1(log_upper - log_tail)
+
+        return {'choc_mus_dir': direction / np.linalg.norm(direction),
+                'choc_mus_loc': mus_adj.mean(),
+                'choc_sigmas_mean': sigmas_mean,
+                'choc_sigmas_alpha': sigmas_alpha,
+                'choc_sigmas_raw': sigmas * sigmas_alpha / sigmas_mean,
+                'ratings_u': np.clip(ratings_u, 1e-6, 1 - 1e-6)}
+
+    return dict(inits,
+                choc_sigmas_mean=sigmas_mean,
+                choc_sigmas_alpha=sigmas_alpha)
+
+def chain_inits(stan_data,
+                chains=4,
+                model='choc_model.stan',
+                jitter=0.1,
+                seed=None):
+
+    # one set of inits per chain, jittered so chains start apart while the
+    # ratings stay ordered
+    inits = data_inits(stan_data)
+    rng = np.random.default_rng(seed)
+
+    jittered = []
+    for _ in range(chains):
+        chain = {'ratings': np.sort(inits['ratings'] + jitter * rng.normal(size=inits['ratings'].shape), axis=1),
+                 'choc_mus_fitted': inits['choc_mus_fitted'] + jitter * rng.normal(size=len(inits['choc_mus_fitted'])),
+                 'choc_sigmas_fitted': inits['choc_sigmas_fitted'] * np.exp(jitter * rng.normal(size=len(inits['choc_sigmas_fitted'])))}
+        jittered.append(_model_inits(chain, model, np.asarray(stan_data['rankings'])))
+
+    return jittered
+
+class RankingModelMixin():
+
+    # data handling, saved posteriors and plots shared by StanModel and
+    # src.models.pymc.PymcModel, which provide plot_config and get_stan_variable
+
+    def _read_rankings(self,
+                       choc_rankings):
+
+        # a ranking_df keeps the chocolate labels for plots and saved posteriors
+        if isinstance(choc_rankings, pd.DataFrame):
+            self.data_df = choc_rankings
+
+            self.choc_lookup = self.data_df[['choc_idx','choc']].drop_duplicates().sort_values('choc_idx')
+
+            return ranking_df_to_array(choc_rankings)
+
+        return choc_rankings
+
+    def save_posterior(self,
+                       path,
+                       stan_vars=('choc_mus_fitted', 'choc_mus_adj', 'choc_sigmas_fitted')):
+
+        # draws needed by src.models.predict_model, which loads them without cmdstanpy
+        posterior = {stan_var: self.get_stan_variable(stan_var) for stan_var in stan_vars}
+
+        if hasattr(self, 'choc_lookup'):
+            posterior['chocs'] = self.choc_lookup['choc'].astype(str).to_numpy()
+
+        np.savez(path, **posterior)
+
+        return path
+
+    def viz_samples_violin(self,
+                           stan_var,
+                           yaxis_title,
+                           xaxis_labels=False,
+                           actuals=None,
+                           summary=False,
+                           n_grid=200):
+
+        return plot_samples_violin(self.get_stan_variable(stan_var),
+                                   yaxis_title,
+                                   choc_labels=self.choc_lookup['choc'].tolist() if xaxis_labels is True else None,
+                                   actuals=actuals,
+                                   summary=summary,
+                                   n_grid=n_grid,
+                                   plot_config=self.plot_config)
+
+    def viz_pop_ranking_samples(self,
+                                n_rows=4,
+                                n_cols=5):
+
+        fig = plot_pop_ranking_samples(self.get_stan_variable('choc_mus_fitted'),
+                                       self.choc_lookup['choc'].tolist(),
+                                       n_rows=n_rows,
+                                       n_cols=n_cols)
+
+        fig.show()
+
+class StanModel(RankingModelMixin, CmdStanModel):
 
     def __init__(self,
                  filename,
@@ -21,131 +209,142 @@ class StanModel(CmdStanModel):
                  **kwargs):
 
         self.filename = os.path.join(stan_model_dir,
-                                     filename)
+                                     model_files.get(filename, filename))
 
         self.plot_config = plot_config
 
-        super().__init__(stan_file = self.filename)
+        self.compile_stats = FitRecorder()
+        with self.compile_stats.stage('compile'):
+            super().__init__(stan_file = self.filename,
+                             **kwargs)
 
     def fit(self,
             choc_rankings,
+            draws_dir=None,
+            draws_vars=None,
+            ess_vars=('choc_mus_fitted', 'choc_sigmas_fitted'),
+            segments=None,
             **kwargs):
 
-        if isinstance(choc_rankings, pd.DataFrame):
-            self.data_df = choc_rankings
+        # every fit records per-stage timings and sampler statistics
+        self.fit_stats = FitRecorder()
+        self.fit_stats.stages.update(self.compile_stats.stages)
 
-            self.choc_lookup = self.data_df[['choc_idx','choc']].drop_duplicates().sort_values('choc_idx')
+        with self.fit_stats.stage('data'):
+            choc_rankings_array = self._read_rankings(choc_rankings)
+
+            # only models declaring segment data need every person to have one
+            if (segments is None and isinstance(choc_rankings, pd.DataFrame)
+                    and 'segment_idx' in choc_rankings.columns and 'n_segments' in self.code()):
+                self.segment_lookup = (self.data_df[['segment_idx','segment']].
+                                       drop_duplicates().
+                                       sort_values('segment_idx'))
+                segments = ranking_df_to_segments(choc_rankings)
 
-            choc_rankings_array = np.array([choc_rankings[choc_rankings['person_idx']==i]['choc_idx'].
-                                            to_numpy() for i in range(choc_rankings['person'].nunique())])
+            self.data = make_stan_data(choc_rankings_array, segments=segments)
+
+            if isinstance(kwargs.get('inits'), str) and kwargs['inits'] == 'data':
+                kwargs['inits'] = self._write_inits(kwargs)
+
+        self.draws_dir = draws_dir
+
+        if draws_dir is None:
+            with self.fit_stats.stage('sample'):
+                self.fit = self.sample(self.data,
+                                       **kwargs)
+
+            with self.fit_stats.stage('csv_parse'):
+                self.fit.draws()
         else:
-            choc_rankings_array = choc_rankings
+            # chain csvs are converted to memory-mapped arrays as they are written
+            kwargs.setdefault('output_dir', os.path.join(draws_dir, 'csv'))
+            if draws_vars is not None:
+                # fit stats read ess_vars back from the arrays, anything not
+                # streamed would send get_stan_variable to parse every csv
+                draws_vars = list(draws_vars) + [stan_var for stan_var in ess_vars if stan_var not in draws_vars]
+                self._check_draws_vars(draws_vars)
+                draws_vars = draws_vars + sampler_columns
 
-        self.data =  {'n_people': choc_rankings_array.shape[0],
-                    'n_chocs': choc_rankings_array.shape[1],
-                    'rankings': np.flip(choc_rankings_array, axis=1).astype('int')}
-        
-        self.fit = self.sample(self.data,
-                               **kwargs)
+            # only this run's csvs are streamed if output_dir holds earlier ones
+            run = None
+            streamer = DrawStreamer(kwargs['output_dir'], draws_dir, stan_vars=draws_vars).start()
+            try:
+                with self.fit_stats.stage('sample'):
+                    run = self.sample(self.data,
+                                      **kwargs)
+            finally:
+                with self.fit_stats.stage('csv_parse'):
+                    streamer.stop(csv_files=run.runset.csv_files if run is not None else None)
 
-    def viz_samples_violin(self,
-                           stan_var,
-                           yaxis_title,
-                           xaxis_labels=False,
-                           actuals=None):
-
-        fig = px.violin(self.fit.stan_variable(stan_var),
-                        **self.plot_config)
-
-        if xaxis_labels is True:
-
-            fig.update_layout(xaxis = dict(tickmode = 'array',
-                                           tickvals = self.choc_lookup['choc_idx'].tolist(),
-                                           ticktext = self.choc_lookup['choc'].tolist()
-                                           ))
-
-        if actuals is not None:
-            for i in range(0, len(actuals)):
-
-                fig.add_shape(
-                    type='line',
-                    x0=(i-0.5),
-                    y0=(actuals[i]),
-                    x1=i+0.5,
-                    y1=(actuals[i]),
-                    line=dict(
-                        color='Red',
-                    )
-                )
-
-        fig.update_layout({
-                           'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                           'paper_bgcolor': 'rgba(0, 0, 0, 0)'
-                           },
-                           showlegend=False)
-                           
-        fig.update_xaxes(showline=True,
-                        linewidth=1,
-                        linecolor='black',
-                        title='chocolate',
-                        tickangle=270)
-
-        fig.update_yaxes(showline=True,
-                        linewidth=1,
-                        linecolor='black',
-                        title=yaxis_title)
-
-        return fig
+            self.fit = run
 
-    def viz_pop_ranking_samples(self,
-                                n_rows=4,
-                                n_cols=5):
+        self._record_fit_stats(ess_vars)
+
+    def _check_draws_vars(self,
+                          draws_vars):
+
+        # an unknown name would otherwise only fail in the streaming thread
+        # once sampling had started
+        info = self.src_info()
+        if not info:
+            return
+
+        known = set(method_columns)
+        for block in ('parameters', 'transformed parameters', 'generated quantities'):
+            known.update(info.get(block, {}))
+
+        unknown = [stan_var for stan_var in draws_vars if stan_var not in known]
+        if unknown:
+            raise ValueError('draws_vars {unknown} are not variables of {model}'.format(unknown=unknown,
+                                                                                      model=os.path.basename(self.filename)))
+
+    def _write_inits(self,
+                     sample_kwargs):
+
+        # cmdstan takes one init file per chain
+        init_dir = sample_kwargs.get('output_dir') or tempfile.mkdtemp()
+        os.makedirs(init_dir, exist_ok=True)
+
+        init_files = []
+        for chain, inits in enumerate(chain_inits(self.data,
+                                                  chains=sample_kwargs.get('chains', 4),
+                                                  model=os.path.basename(self.filename),
+                                                  seed=sample_kwargs.get('seed'))):
+            init_file = os.path.join(init_dir, 'inits_{i}.json'.format(i=chain + 1))
+            write_stan_json(init_file, inits)
+            init_files.append(init_file)
+
+        return init_files
+
+    def _record_fit_stats(self,
+                          ess_vars):
+
+        self.fit_stats.record_sampler({col: self.get_stan_variable(col) for col in sampler_columns},
+                                      self.fit.runset.csv_files)
+
+        for stan_var in ess_vars:
+            self.fit_stats.record_ess(stan_var,
+                                      self.get_stan_variable(stan_var),
+                                      self.fit.chains)
+
+        self.fit_stats.record_peak_rss()
+        self.fit_stats.log(model=os.path.basename(self.filename),
+                           n_people=int(self.data['n_people']))
+
+        if self.draws_dir is not None:
+            self.fit_stats.export(os.path.join(self.draws_dir, 'fit_stats.jsonl'),
+                                  model=os.path.basename(self.filename))
+
+    def get_stan_variable(self,
+                          stan_var):
+
+        if getattr(self, 'draws_dir', None) is not None:
+            try:
+                return load_stan_variable(self.draws_dir, stan_var)
+            except KeyError:
+                pass
+
+        if stan_var in sampler_columns:
+            return self.fit.method_variables()[stan_var]
 
-        sample_argsort = np.argsort(-self.fit.stan_variable('choc_mus_fitted'), axis=1)
-
-        fig = make_subplots(rows=n_rows,
-                            cols=n_cols,
-                            shared_xaxes='all',
-                            shared_yaxes='all',
-                            subplot_titles=self.choc_lookup['choc'].tolist())
-
-        for i in range(self.data['rankings'].shape[1]):
-
-            row_idx = (i//n_cols) + 1
-            col_idx = (i % n_cols) + 1
-            fig.append_trace(
-                go.Histogram(x=np.where(sample_argsort==i)[1],
-                                histnorm='probability',
-                                name=str(i)),
-                row=row_idx,
-                col=col_idx
-            )
-
-        fig.update_layout(
-        {
-        'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-        'paper_bgcolor': 'rgba(0, 0, 0, 0)'
-        },
-        showlegend=False,
-        height=800,
-        width=1000,
-        font=dict(
-                size=10
-            ))
-
-        fig.update_xaxes(showline=True,
-                            showticklabels=True,
-                            linewidth=1,
-                            linecolor='black',
-                            tick0=0,
-                            dtick=1,
-                            tickangle=270
-                            )
-        fig.update_yaxes(showline=True,
-                            showticklabels=True,
-                            linewidth=1,
-                            linecolor='black',
-                            tick0=0,
-                            dtick=0.25)
-
-        fig.show()
\ No newline at end of file
+        return self.fit.stan_variable(stan_var)
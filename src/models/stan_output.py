@@ -0,0 +1,351 @@
+import numpy as np
+
+import os
+import re
+import glob
+import json
+import threading
+
+
+# cmdstan writes its run configuration as comments ahead of the csv header,
+# e.g. "#     num_samples = 1000 (Default)"
+config_pattern = re.compile(r'^#\s*(\w+)\s*=\s*([^\s(]+)')
+
+# and its timings as trailing comments, e.g. "#  Elapsed Time: 0.25 seconds (Warm-up)"
+elapsed_pattern = re.compile(r'^#\s*(?:Elapsed Time:)?\s*([\d.]+) seconds \(([\w-]+)\)')
+
+meta_filename = 'draws.json'
+
+
+def parse_column(column):
+
+    # cmdstan flattens containers into columns such as ratings.3.12
+    name, *idx = column.split('.')
+
+    return name, tuple(int(i) - 1 for i in idx)
+
+
+def _is_true(value):
+
+    return value.lower() in ('1', 'true')
+
+
+class CsvDrawStream():
+
+    def __init__(self,
+                 csv_file,
+                 out_dir,
+                 stan_vars=None):
+
+        self.csv_file = csv_file
+        self.out_dir = out_dir
+        self.stan_vars = stan_vars
+
+        self.config = {}
+        self.columns = None
+        self.arrays = {}
+        self.n_rows = None
+        self.n_skip = 0
+        self.n_read = 0
+
+        self._offset = 0
+        self._remainder = b''
+
+    @property
+    def chain_id(self):
+
+        if 'id' in self.config:
+            return int(self.config['id'])
+
+        return int(os.path.splitext(self.csv_file)[0].rsplit('_', 1)[-1])
+
+    @property
+    def n_draws(self):
+
+        return min(max(self.n_read - self.n_skip, 0), self.n_rows or 0)
+
+    def poll(self):
+
+        # only complete lines are consumed, anything after the last newline
+        # is kept until the chain has written the rest of it
+        with open(self.csv_file, 'rb') as f:
+            f.seek(self._offset)
+            chunk = f.read()
+            self._offset = f.tell()
+
+        if not chunk:
+            return 0
+
+        lines = (self._remainder + chunk).split(b'\n')
+        self._remainder = lines.pop()
+
+        rows = []
+        for line in lines:
+            if not line.strip():
+                continue
+            if line.startswith(b'#'):
+                if self.columns is None:
+                    match = config_pattern.match(line.decode())
+                    if match:
+                        self.config.setdefault(*match.groups())
+                continue
+            if self.columns is None:
+                try:
+                    self._init_arrays(line.decode().strip().split(','))
+                except ValueError:
+                    # start over next time, so every poll raises the same error
+                    self._offset, self._remainder = 0, b''
+                    raise
+                continue
+            rows.append(line)
+
+        if rows:
+            self._write_rows(rows)
+
+        return len(rows)
+
+    def _n_expected_rows(self):
+
+        thin = int(self.config.get('thin', 1))
+        n_samples = -(-int(self.config.get('num_samples', 1000)) // thin)
+        n_warmup = 0
+
+        if _is_true(self.config.get('save_warmup', '0')):
+            n_warmup = -(-int(self.config.get('num_warmup', 1000)) // thin)
+
+        return n_warmup, n_samples
+
+    def _init_arrays(self,
+                     columns):
+
+        self.n_skip, self.n_rows = self._n_expected_rows()
+
+        variables = {}
+        for col_idx, column in enumerate(columns):
+            name, idx = parse_column(column)
+            if self.stan_vars is not None and name not in self.stan_vars:
+                continue
+            variables.setdefault(name, []).append((col_idx, idx))
+
+        if not variables:
+            raise ValueError('none of {vars} found in {file}'.format(vars=self.stan_vars,
+                                                                     file=self.csv_file))
+
+        for name, cols in variables.items():
+
+            dims = tuple(int(d) + 1 for d in np.max([idx for _, idx in cols], axis=0)) if cols[0][1] else ()
+
+            # position of every csv column in the C ordered draw array, so
+            # the column ordering used by cmdstan does not matter here
+            flat_idx = np.array([np.ravel_multi_index(idx, dims) if dims else 0
+                                 for _, idx in cols])
+
+            var_dir = os.path.join(self.out_dir, name)
+            os.makedirs(var_dir, exist_ok=True)
+
+            self.arrays[name] = {
+                'usecols': np.array([col_idx for col_idx, _ in cols]),
+                'flat_idx': flat_idx,
+                'array': np.lib.format.open_memmap(
+                    os.path.join(var_dir, 'chain_{id}.npy'.format(id=self.chain_id)),
+                    mode='w+',
+                    dtype=np.float64,
+                    shape=(self.n_rows,) + dims)
+                }
+
+        self.columns = columns
+        self._usecols = np.unique(np.concatenate([a['usecols'] for a in self.arrays.values()]))
+
+    def _write_rows(self,
+                    rows):
+
+        values = np.loadtxt([row.decode() for row in rows],
+                            delimiter=',',
+                            usecols=self._usecols,
+                            dtype=np.float64,
+                            ndmin=2)
+
+        # drop saved warmup draws so the arrays line up with stan_variable()
+        start = self.n_read - self.n_skip
+        self.n_read += values.shape[0]
+        if start < 0:
+            values = values[-start:]
+            start = 0
+
+        values = values[:max(self.n_rows - start, 0)]
+        if values.shape[0] == 0:
+            return
+
+        stop = start + values.shape[0]
+        for var in self.arrays.values():
+            flat = var['array'].reshape(self.n_rows, -1)
+            flat[start:stop, var['flat_idx']] = values[:, np.searchsorted(self._usecols, var['usecols'])]
+
+    def close(self):
+
+        self.poll()
+
+        for var in self.arrays.values():
+            var['array'].flush()
+
+
+class DrawStreamer():
+
+    def __init__(self,
+                 csv_dir,
+                 out_dir,
+                 stan_vars=None,
+                 poll_interval=0.5):
+
+        self.csv_dir = csv_dir
+        self.out_dir = out_dir
+        self.stan_vars = stan_vars
+        self.poll_interval = poll_interval
+
+        self.streams = {}
+        self._stale = set()
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll(self):
+
+        for csv_file in sorted(glob.glob(os.path.join(self.csv_dir, '*.csv'))):
+            if csv_file in self._stale:
+                continue
+            if csv_file not in self.streams:
+                self.streams[csv_file] = CsvDrawStream(csv_file,
+                                                       self.out_dir,
+                                                       stan_vars=self.stan_vars)
+            self.streams[csv_file].poll()
+
+    def _run(self):
+
+        while not self._stop.wait(self.poll_interval):
+            self.poll()
+
+    def clear(self):
+
+        # csvs already in csv_dir belong to an earlier run into the same
+        # directory, and its arrays and manifest would be mixed with this one's
+        self._stale = set(glob.glob(os.path.join(self.csv_dir, '*.csv')))
+
+        for path in glob.glob(os.path.join(self.out_dir, '*', 'chain_*.npy')):
+            os.remove(path)
+        if os.path.exists(os.path.join(self.out_dir, meta_filename)):
+            os.remove(os.path.join(self.out_dir, meta_filename))
+
+    def start(self):
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.clear()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self,
+             csv_files=None):
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+        self.poll()
+
+        # csv_files, e.g. fit.runset.csv_files, restricts the manifest to one run
+        if csv_files is not None:
+            keep = {os.path.abspath(csv_file) for csv_file in csv_files}
+            self.streams = {csv_file: stream for csv_file, stream in self.streams.items()
+                            if os.path.abspath(csv_file) in keep}
+
+        for stream in self.streams.values():
+            stream.close()
+
+        self._write_meta()
+
+    def _write_meta(self):
+
+        streams = sorted((s for s in self.streams.values() if s.columns is not None),
+                         key=lambda s: s.chain_id)
+
+        meta = {'chains': [{'chain_id': s.chain_id,
+                            'csv_file': s.csv_file,
+                            'n_draws': s.n_draws} for s in streams],
+                'stan_vars': sorted(set().union(*[s.arrays for s in streams]))}
+
+        with open(os.path.join(self.out_dir, meta_filename), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def __enter__(self):
+
+        return self.start()
+
+    def __exit__(self, *exc):
+
+        self.stop()
+
+
+def stream_csv_files(csv_files,
+                     out_dir,
+                     stan_vars=None):
+
+    # convert csv files from a finished run, e.g. one read back from disk
+    os.makedirs(out_dir, exist_ok=True)
+
+    streamer = DrawStreamer(None, out_dir, stan_vars=stan_vars)
+    for csv_file in csv_files:
+        streamer.streams[csv_file] = CsvDrawStream(csv_file,
+                                                   out_dir,
+                                                   stan_vars=stan_vars)
+
+    for stream in streamer.streams.values():
+        stream.close()
+
+    streamer._write_meta()
+
+    return out_dir
+
+
+def read_elapsed_times(csv_file,
+                       tail_bytes=4096):
+
+    with open(csv_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - tail_bytes, 0))
+        tail = f.read().decode(errors='replace')
+
+    elapsed = {}
+    for line in tail.splitlines():
+        match = elapsed_pattern.match(line.strip())
+        if match:
+            elapsed[match.group(2).lower().replace('-', '')] = float(match.group(1))
+
+    return elapsed
+
+
+def read_draws_meta(out_dir):
+
+    with open(os.path.join(out_dir, meta_filename), 'r') as f:
+        return json.load(f)
+
+
+def load_stan_variable(out_dir,
+                       stan_var,
+                       mmap_mode='r'):
+
+    meta = read_draws_meta(out_dir)
+
+    if stan_var not in meta['stan_vars']:
+        raise KeyError('{var} was not written to {dir}'.format(var=stan_var, dir=out_dir))
+
+    chains = [np.load(os.path.join(out_dir, stan_var, 'chain_{id}.npy'.format(id=c['chain_id'])),
+                      mmap_mode=mmap_mode)[:c['n_draws']]
+              for c in meta['chains']]
+
+    # a single chain stays memory-mapped, otherwise only this variable is read
+    if len(chains) == 1:
+        return chains[0]
+
+    return np.concatenate(chains, axis=0)
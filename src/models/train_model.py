@@ -0,0 +1,328 @@
+import click
+import logging
+
+import os
+import sys
+import glob
+import json
+import pickle
+import inspect
+import hashlib
+
+from src.hashing import file_hash, src_dependencies
+
+import git
+git_root = git.Repo(search_parent_directories=True).git.rev_parse("--show-toplevel")
+
+pipeline_cache_dir = os.path.join(git_root, 'data', 'interim', 'pipeline')
+external_data_dir = os.path.join(git_root, 'data', 'external')
+
+logger = logging.getLogger(__name__)
+
+
+def hash_json(obj):
+
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Stage():
+
+    def __init__(self,
+                 name,
+                 func,
+                 deps=(),
+                 params=None,
+                 modules=(),
+                 inputs=None):
+
+        # modules are the code a stage depends on beyond its own function,
+        # inputs returns the content hashes of any files read directly
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.params = params or {}
+        self.modules = tuple(modules)
+        self.inputs = inputs
+
+    def code_hash(self):
+
+        sources = [inspect.getsource(self.func)]
+        sources += [inspect.getsource(sys.modules[module]) for module in self.modules]
+
+        return hashlib.sha256(''.join(sources).encode()).hexdigest()
+
+    def key(self,
+            dep_hashes):
+
+        return hash_json({'stage': self.name,
+                          'code': self.code_hash(),
+                          'params': self.params,
+                          'deps': dep_hashes,
+                          'inputs': self.inputs() if self.inputs is not None else None})[:16]
+
+
+class Pipeline():
+
+    def __init__(self,
+                 stages,
+                 cache_dir=pipeline_cache_dir):
+
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = cache_dir
+
+        self.outputs = {}
+        self.output_hashes = {}
+        self.ran = []
+
+    def _order(self,
+               targets):
+
+        order = []
+
+        def visit(name, path=()):
+            if name in path:
+                raise ValueError('pipeline has a cycle through {name}'.format(name=name))
+            if name in order:
+                return
+            for dep in self.stages[name].deps:
+                visit(dep, path + (name,))
+            order.append(name)
+
+        for target in targets:
+            visit(target)
+
+        return order
+
+    def _paths(self,
+               name,
+               key):
+
+        stage_dir = os.path.join(self.cache_dir, name)
+        os.makedirs(stage_dir, exist_ok=True)
+
+        return (os.path.join(stage_dir, '{key}.pkl'.format(key=key)),
+                os.path.join(stage_dir, '{key}.json'.format(key=key)))
+
+    def output(self,
+               name):
+
+        # cached outputs are only unpickled when a stage that needs them runs
+        if name not in self.outputs:
+            with open(self._cached[name], 'rb') as f:
+                self.outputs[name] = pickle.load(f)
+
+        return self.outputs[name]
+
+    def run(self,
+            targets=None,
+            force=()):
+
+        targets = list(self.stages) if targets is None else targets
+        self._cached = {}
+
+        for name in self._order(targets):
+
+            stage = self.stages[name]
+            key = stage.key([self.output_hashes[dep] for dep in stage.deps])
+            output_path, meta_path = self._paths(name, key)
+
+            if name not in force and os.path.exists(meta_path) and os.path.exists(output_path):
+                with open(meta_path, 'r') as f:
+                    self.output_hashes[name] = json.load(f)['output_hash']
+                self._cached[name] = output_path
+                logger.info('{name}: cached ({key})'.format(name=name, key=key))
+                continue
+
+            logger.info('{name}: running ({key})'.format(name=name, key=key))
+            output = stage.func(*[self.output(dep) for dep in stage.deps], **stage.params)
+
+            payload = pickle.dumps(output)
+            with open(output_path, 'wb') as f:
+                f.write(payload)
+
+            # downstream keys use the content of this output rather than its
+            # key, so a rerun that reproduces the same output stops here
+            self.output_hashes[name] = hashlib.sha256(payload).hexdigest()
+            with open(meta_path, 'w') as f:
+                json.dump({'key': key,
+                           'output_hash': self.output_hashes[name],
+                           'params': stage.params}, f, indent=2, default=str)
+
+            self.outputs[name] = output
+            self._cached[name] = output_path
+            self.ran.append(name)
+
+        return {target: self.output(target) for target in targets}
+
+
+def external_file_hashes():
+
+    from src.data import make_dataset
+
+    # every file read_files opens, the rankings and the optional segments lookup
+    paths = sorted(glob.glob(os.path.join(external_data_dir, '*.txt')))
+    if os.path.exists(make_dataset.segments_path):
+        paths.append(make_dataset.segments_path)
+
+    return {os.path.basename(path): file_hash(path) for path in paths}
+
+
+def ingest():
+
+    from src.data.make_dataset import read_files, validate_rankings, write_quarantine
+
+    # bad rankings are set aside with their reasons rather than failing the run
+    raw_data, quarantined = validate_rankings(read_files())
+    write_quarantine(quarantined)
+    if quarantined:
+        logger.warning('{n} rankings quarantined'.format(n=len(quarantined)))
+
+    return raw_data
+
+
+def ranking(raw_data):
+
+    from src.data.make_dataset import raw_data_to_df
+
+    ranking_df = raw_data_to_df(raw_data)
+
+    with open(os.path.join(git_root, 'data', 'processed', 'ranking_df.pkl'), 'wb') as f:
+        pickle.dump(ranking_df, f)
+
+    return ranking_df
+
+
+def index(ranking_df):
+
+    from src.features.build_features import RankingIndex
+
+    path = RankingIndex.from_ranking_df(ranking_df).save()
+
+    return {'path': path, 'hash': file_hash(path)}
+
+
+def fit(ranking_df,
+        name,
+        model,
+        sample_kwargs):
+
+    from src.models.stan_models import StanModel
+
+    draws_dir = os.path.join(git_root, 'models', name)
+
+    stan_model = StanModel(model)
+    stan_model.fit(ranking_df,
+                   draws_dir=draws_dir,
+                   output_dir=os.path.join(draws_dir, 'csv'),
+                   **sample_kwargs)
+
+    posterior = stan_model.save_posterior(os.path.join(git_root, 'models', '{name}.npz'.format(name=name)))
+
+    return {'posterior': posterior,
+            'posterior_hash': file_hash(posterior),
+            'draws_dir': draws_dir,
+            'csv_files': list(stan_model.fit.runset.csv_files)}
+
+
+def diagnostics(fit_output,
+                name):
+
+    import cmdstanpy
+
+    stan_fit = cmdstanpy.from_csv(fit_output['csv_files'])
+
+    summary = stan_fit.summary()
+    summary.to_csv(os.path.join(git_root, 'models', '{name}_summary.csv'.format(name=name)))
+
+    return {'summary': summary,
+            'diagnose': stan_fit.diagnose()}
+
+
+def figures(fit_output,
+            index_output,
+            name,
+            formats):
+
+    from src.visualization.build_report import build_report
+
+    return build_report({name: fit_output['posterior']},
+                        index_path=index_output['path'],
+                        formats=formats)
+
+
+def make_pipeline(name='real',
+                  model='choc_model.stan',
+                  sample_kwargs=None,
+                  formats=('json',),
+                  cache_dir=pipeline_cache_dir):
+
+    # modules are imported here so their source can be hashed with each stage
+    import src.data.make_dataset
+    import src.features.build_features
+    import src.models.stan_models
+    import src.visualization.build_report
+    import src.visualization.visualize
+    import src.visualization.viz_rankings
+
+    stan_file = os.path.join(src.models.stan_models.stan_model_dir,
+                             src.models.stan_models.model_files.get(model, model))
+
+    stages = [Stage('ingest', ingest,
+                    modules=['src.data.make_dataset'],
+                    inputs=external_file_hashes),
+              Stage('ranking', ranking, deps=['ingest'],
+                    modules=['src.data.make_dataset']),
+              Stage('index', index, deps=['ranking'],
+                    modules=['src.features.build_features']),
+              Stage('fit', fit, deps=['ranking'],
+                    params={'name': name, 'model': model, 'sample_kwargs': sample_kwargs or {}},
+                    modules=['src.models.stan_models'],
+                    inputs=lambda: file_hash(stan_file)),
+              Stage('diagnostics', diagnostics, deps=['fit'],
+                    params={'name': name}),
+              Stage('figures', figures, deps=['fit', 'index'],
+                    params={'name': name, 'formats': list(formats)},
+                    modules=src_dependencies('src.visualization.build_report'))]
+
+    return Pipeline(stages, cache_dir=cache_dir)
+
+
+@click.command()
+@click.option('--name', default='real', help='name used for the saved fit and figures')
+@click.option('--model', default='choc_model.stan')
+@click.option('--chains', default=4, type=int)
+@click.option('--iter-warmup', default=1000, type=int)
+@click.option('--iter-sampling', default=1000, type=int)
+@click.option('--step-size', default=None, type=float)
+@click.option('--seed', default=None, type=int)
+@click.option('--format', 'formats', multiple=True, default=['json'])
+@click.option('--target', 'targets', multiple=True,
+              help='stages to bring up to date, defaults to all')
+@click.option('--force', multiple=True, help='stages to rerun even if cached')
+def main(name, model, chains, iter_warmup, iter_sampling, step_size, seed, formats, targets, force):
+    """ Runs ingest -> ranking matrix -> fit -> diagnostics -> figures,
+        rerunning only the stages whose code, parameters or inputs changed.
+    """
+    sample_kwargs = {'chains': chains,
+                     'iter_warmup': iter_warmup,
+                     'iter_sampling': iter_sampling}
+    if step_size is not None:
+        sample_kwargs['step_size'] = step_size
+    if seed is not None:
+        sample_kwargs['seed'] = seed
+
+    pipeline = make_pipeline(name=name,
+                             model=model,
+                             sample_kwargs=sample_kwargs,
+                             formats=formats)
+
+    pipeline.run(targets=list(targets) or None, force=force)
+
+    logger.info('stages run: {ran}'.format(ran=', '.join(pipeline.ran) or 'none'))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
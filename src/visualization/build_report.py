@@ -0,0 +1,225 @@
+import click
+import logging
+
+import os
+import glob
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import src.visualization.visualize as visualize
+import src.visualization.viz_rankings as viz_rankings
+from src.features.build_features import RankingIndex, ranking_index_path
+from src.models.predict_model import load_posterior
+from src.hashing import file_hash, modules_hash, src_dependencies
+
+import git
+git_root = git.Repo(search_parent_directories=True).git.rev_parse("--show-toplevel")
+
+figures_dir = os.path.join(git_root, 'reports', 'figures')
+manifest_filename = 'manifest.json'
+
+logger = logging.getLogger(__name__)
+
+
+def _choc_labels(posterior):
+
+    return [str(c) for c in posterior['chocs']] if 'chocs' in posterior else None
+
+
+def render_mus_violin(source, **params):
+
+    posterior = load_posterior(source)
+
+    return visualize.plot_samples_violin(posterior['choc_mus_fitted'],
+                                         'mean latent rating',
+                                         choc_labels=_choc_labels(posterior),
+                                         **params)
+
+
+def render_sigmas_violin(source, **params):
+
+    posterior = load_posterior(source)
+
+    return visualize.plot_samples_violin(posterior['choc_sigmas_fitted'],
+                                         'sd of latent ratings',
+                                         choc_labels=_choc_labels(posterior),
+                                         **params)
+
+
+def render_pop_ranking(source, **params):
+
+    posterior = load_posterior(source)
+
+    return visualize.plot_pop_ranking_samples(posterior['choc_mus_fitted'],
+                                              _choc_labels(posterior),
+                                              **params)
+
+
+def render_rank_means(source, **params):
+
+    return viz_rankings.plot_rank_means(RankingIndex.load(source), **params)
+
+
+def render_top_bottom_n(source, **params):
+
+    return viz_rankings.plot_top_bottom_n(RankingIndex.load(source), **params)
+
+
+posterior_figures = {'mus_violin': (render_mus_violin, {'summary': True}),
+                     'sigmas_violin': (render_sigmas_violin, {'summary': True}),
+                     'pop_ranking': (render_pop_ranking, {})}
+
+index_figures = {'rank_means': (render_rank_means, {}),
+                 'top_bottom_5': (render_top_bottom_n, {'n': 5})}
+
+
+def figure_specs(fits,
+                 index_path=None):
+
+    specs = []
+    for fit_name, path in fits.items():
+        for figure, (render, params) in posterior_figures.items():
+            specs.append({'name': '{fit}_{figure}'.format(fit=fit_name, figure=figure),
+                          'render': render.__name__,
+                          'source': path,
+                          'params': params})
+
+    if index_path is not None and os.path.exists(index_path):
+        for figure, (render, params) in index_figures.items():
+            specs.append({'name': figure,
+                          'render': render.__name__,
+                          'source': index_path,
+                          'params': params})
+
+    return specs
+
+
+def _code_hash():
+
+    # figures are re-rendered whenever any code the renderers run changes
+    return modules_hash(src_dependencies(__name__))
+
+
+def cache_key(spec,
+              source_hash,
+              code_hash):
+
+    key = json.dumps({'source': source_hash,
+                      'render': spec['render'],
+                      'params': spec['params'],
+                      'code': code_hash}, sort_keys=True)
+
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def render_figure(spec,
+                  out_dir,
+                  formats):
+
+    fig = globals()[spec['render']](spec['source'], **spec['params'])
+
+    files = []
+    for fmt in formats:
+        path = os.path.join(out_dir, '{name}.{fmt}'.format(name=spec['name'], fmt=fmt))
+        if fmt == 'json':
+            fig.write_json(path)
+        elif fmt == 'html':
+            fig.write_html(path, include_plotlyjs='cdn')
+        else:
+            # static images need the optional kaleido package
+            fig.write_image(path)
+        files.append(os.path.basename(path))
+
+    return files
+
+
+def build_report(fits,
+                 index_path=ranking_index_path,
+                 out_dir=figures_dir,
+                 formats=('json',),
+                 n_workers=None):
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    manifest_path = os.path.join(out_dir, manifest_filename)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    specs = figure_specs(fits, index_path=index_path)
+
+    code_hash = _code_hash()
+    source_hashes = {source: file_hash(source) for source in {spec['source'] for spec in specs}}
+
+    to_render = []
+    for spec in specs:
+        spec['key'] = cache_key(spec, source_hashes[spec['source']], code_hash)
+        cached = manifest.get(spec['name'], {})
+
+        if (cached.get('key') == spec['key'] and
+                set(cached.get('formats', [])) >= set(formats) and
+                all(os.path.exists(os.path.join(out_dir, f)) for f in cached.get('files', []))):
+            continue
+
+        to_render.append(spec)
+
+    logger.info('{n} of {total} figures to render'.format(n=len(to_render), total=len(specs)))
+
+    if to_render:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            rendered = pool.map(render_figure,
+                                to_render,
+                                [out_dir] * len(to_render),
+                                [formats] * len(to_render))
+
+            for spec, files in zip(to_render, rendered):
+                manifest[spec['name']] = {'key': spec['key'],
+                                          'source': os.path.relpath(spec['source'], git_root),
+                                          'render': spec['render'],
+                                          'params': spec['params'],
+                                          'formats': list(formats),
+                                          'files': files}
+
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def find_fits(fit_dir=os.path.join(git_root, 'models')):
+
+    return {os.path.splitext(os.path.basename(path))[0]: path
+            for path in sorted(glob.glob(os.path.join(fit_dir, '*.npz')))}
+
+
+@click.command()
+@click.option('--fit', 'fits', multiple=True,
+              help='saved posterior as name=path, defaults to every models/*.npz')
+@click.option('--index', 'index_path', default=ranking_index_path, type=click.Path())
+@click.option('--out-dir', default=figures_dir, type=click.Path())
+@click.option('--format', 'formats', multiple=True, default=['json'],
+              type=click.Choice(['json', 'html', 'png', 'svg', 'pdf']))
+@click.option('--workers', 'n_workers', default=None, type=int)
+def main(fits, index_path, out_dir, formats, n_workers):
+    """ Renders report figures from saved posteriors and the ranking index
+        into reports/figures, skipping any whose inputs have not changed.
+    """
+    if fits:
+        fits = dict(fit.split('=', 1) for fit in fits)
+    else:
+        fits = find_fits()
+
+    build_report(fits,
+                 index_path=index_path,
+                 out_dir=out_dir,
+                 formats=formats,
+                 n_workers=n_workers)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
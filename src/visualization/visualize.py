@@ -0,0 +1,214 @@
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+
+def kde_summary(draws,
+                n_grid=200,
+                quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+
+    # per-column gaussian KDE on a fixed grid plus quantiles, so plots are
+    # drawn from n_grid points per column however many draws there are
+    draws = np.asarray(draws, dtype=np.float64).reshape(len(draws), -1)
+    n_draws, n_cols = draws.shape
+
+    sd = draws.std(axis=0, ddof=1)
+    q = np.quantile(draws, (0.25, 0.75) + tuple(quantiles), axis=0)
+    iqr = q[1] - q[0]
+
+    # silverman's rule of thumb, as used by plotly's own violins
+    spread = np.where(iqr > 0, np.minimum(sd, iqr / 1.34), sd)
+    bandwidth = np.maximum(0.9 * spread * n_draws ** -0.2, 1e-12)
+
+    lower = draws.min(axis=0) - 3 * bandwidth
+    upper = draws.max(axis=0) + 3 * bandwidth
+    grid = lower + (upper - lower) * np.linspace(0, 1, n_grid)[:, None]
+    step = (upper - lower) / (n_grid - 1)
+
+    # linear binning of all draws onto the grid in a single bincount
+    position = (draws - lower) / step
+    left = np.clip(np.floor(position).astype(np.int64), 0, n_grid - 2)
+    frac = position - left
+    offset = np.arange(n_cols) * n_grid
+
+    counts = (np.bincount((left + offset).ravel(), weights=(1 - frac).ravel(), minlength=n_cols * n_grid) +
+              np.bincount((left + 1 + offset).ravel(), weights=frac.ravel(), minlength=n_cols * n_grid))
+    counts = counts.reshape(n_cols, n_grid)
+
+    # smoothing the binned counts only costs n_grid x n_grid per column
+    lags = np.arange(n_grid)[:, None] - np.arange(n_grid)[None, :]
+    kernel = np.exp(-0.5 * (lags[None, :, :] * (step / bandwidth)[:, None, None]) ** 2)
+    density = np.einsum('cg,cgh->ch', counts, kernel) / (n_draws * bandwidth[:, None] * np.sqrt(2 * np.pi))
+
+    return {'grid': grid.T,
+            'density': density,
+            'quantiles': dict(zip(quantiles, q[2:])),
+            'mean': draws.mean(axis=0),
+            'n_draws': n_draws}
+
+
+def violin_from_summary(summary,
+                        width=0.8,
+                        color='#636efa'):
+
+    grid = summary['grid']
+    density = summary['density']
+    n_cols = grid.shape[0]
+
+    half_width = width / 2 * density / density.max(axis=1, keepdims=True)
+
+    fig = go.Figure()
+
+    for i in range(n_cols):
+        fig.add_trace(go.Scatter(x=np.concatenate([i - half_width[i], (i + half_width[i])[::-1]]),
+                                 y=np.concatenate([grid[i], grid[i][::-1]]),
+                                 fill='toself',
+                                 mode='lines',
+                                 line=dict(color=color, width=1),
+                                 name=str(i),
+                                 hoverinfo='skip'))
+
+    quantiles = summary['quantiles']
+    levels = sorted(quantiles)
+    x = np.arange(n_cols)
+
+    # whiskers from the outer and a box from the inner quantiles, separated by None
+    for low, high, line_width in [(levels[0], levels[-1], 1), (levels[1], levels[-2], 5)]:
+        fig.add_trace(go.Scatter(x=np.repeat(x, 3),
+                                 y=np.column_stack([quantiles[low], quantiles[high], np.full(n_cols, None)]).ravel(),
+                                 mode='lines',
+                                 line=dict(color='black', width=line_width),
+                                 hoverinfo='skip'))
+
+    fig.add_trace(go.Scatter(x=x,
+                             y=quantiles[levels[len(levels) // 2]],
+                             mode='markers',
+                             marker=dict(color='white', size=5, line=dict(color='black', width=1)),
+                             name='median'))
+
+    return fig
+
+
+def plot_samples_violin(draws,
+                        yaxis_title,
+                        choc_labels=None,
+                        actuals=None,
+                        summary=False,
+                        n_grid=200,
+                        plot_config={'height': 600,
+                                     'width': 1000}):
+
+    if summary:
+        # violins drawn from KDEs computed here rather than from every draw
+        fig = violin_from_summary(kde_summary(draws, n_grid=n_grid))
+        fig.update_layout(**plot_config)
+    else:
+        fig = px.violin(draws,
+                        **plot_config)
+
+    if choc_labels is not None:
+
+        fig.update_layout(xaxis = dict(tickmode = 'array',
+                                       tickvals = list(range(len(choc_labels))),
+                                       ticktext = choc_labels
+                                       ))
+
+    if actuals is not None:
+        for i in range(0, len(actuals)):
+
+            fig.add_shape(
+                type='line',
+                x0=(i-0.5),
+                y0=(actuals[i]),
+                x1=i+0.5,
+                y1=(actuals[i]),
+                line=dict(
+                    color='Red',
+                )
+            )
+
+    fig.update_layout({
+                       'plot_bgcolor': 'rgba(0, 0, 0, 0)',
+                       'paper_bgcolor': 'rgba(0, 0, 0, 0)'
+                       },
+                       showlegend=False)
+
+    fig.update_xaxes(showline=True,
+                    linewidth=1,
+                    linecolor='black',
+                    title='chocolate',
+                    tickangle=270)
+
+    fig.update_yaxes(showline=True,
+                    linewidth=1,
+                    linecolor='black',
+                    title=yaxis_title)
+
+    return fig
+
+
+def pop_rank_probs(mus_draws):
+
+    # probs[c, r] is the share of draws in which chocolate c has population rank r
+    n_draws, n_chocs = mus_draws.shape
+    ranks = np.argsort(np.argsort(-mus_draws, axis=1), axis=1)
+
+    return np.bincount((np.arange(n_chocs) * n_chocs + ranks).ravel(),
+                       minlength=n_chocs * n_chocs).reshape(n_chocs, n_chocs) / n_draws
+
+
+def plot_pop_ranking_samples(mus_draws,
+                             choc_labels,
+                             n_rows=4,
+                             n_cols=5):
+
+    rank_probs = pop_rank_probs(np.asarray(mus_draws))
+
+    fig = make_subplots(rows=n_rows,
+                        cols=n_cols,
+                        shared_xaxes='all',
+                        shared_yaxes='all',
+                        subplot_titles=choc_labels)
+
+    for i in range(rank_probs.shape[0]):
+
+        row_idx = (i//n_cols) + 1
+        col_idx = (i % n_cols) + 1
+        fig.append_trace(
+            go.Bar(x=np.arange(rank_probs.shape[1]),
+                   y=rank_probs[i],
+                   name=str(i)),
+            row=row_idx,
+            col=col_idx
+        )
+
+    fig.update_layout(
+    {
+    'plot_bgcolor': 'rgba(0, 0, 0, 0)',
+    'paper_bgcolor': 'rgba(0, 0, 0, 0)'
+    },
+    showlegend=False,
+    bargap=0,
+    height=800,
+    width=1000,
+    font=dict(
+            size=10
+        ))
+
+    fig.update_xaxes(showline=True,
+                        showticklabels=True,
+                        linewidth=1,
+                        linecolor='black',
+                        tick0=0,
+                        dtick=1,
+                        tickangle=270
+                        )
+    fig.update_yaxes(showline=True,
+                        showticklabels=True,
+                        linewidth=1,
+                        linecolor='black',
+                        tick0=0,
+                        dtick=0.25)
+
+    return fig
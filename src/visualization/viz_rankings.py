@@ -1,14 +1,78 @@
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 
-def plot_rank_means(ranking_df):
+from src.features.build_features import as_ranking_index
 
-    ranking_df['choc'] = ranking_df['choc'].astype('string')
 
-    fig = px.bar(ranking_df.groupby(['choc'])[['rank']].mean().sort_values('rank').reset_index(),
+def _as_index(ranking_df):
+
+    # plots are drawn from the aggregate index, a ranking_df is indexed on the
+    # fly and left unchanged
+    return as_ranking_index(ranking_df)
+
+def _error_columns(plot_df,
+                   interval,
+                   value_col):
+
+    # bootstrap intervals from bootstrap_rank_stats as asymmetric error bars
+    plot_df['error_plus'] = interval['upper'] - plot_df[value_col]
+    plot_df['error_minus'] = plot_df[value_col] - interval['lower']
+
+    return plot_df
+
+def _replicated_traces(chocs,
+                       interval,
+                       horizontal=False):
+
+    # posterior predictive intervals from ppc.posterior_predictive bound the
+    # replicated statistic rather than the observed bars, so they are drawn
+    # as a range centred on their midpoint, with the replicated mean marked
+    mid = (interval['upper'] + interval['lower']) / 2
+    half = (interval['upper'] - interval['lower']) / 2
+
+    def xy(values):
+        return {'x': values, 'y': chocs} if horizontal else {'x': chocs, 'y': values}
+
+    error = {'error_x' if horizontal else 'error_y': {'type': 'data', 'array': half, 'color': 'black'}}
+
+    return [go.Scatter(name='replicated interval',
+                       mode='markers',
+                       marker={'opacity': 0},
+                       hoverinfo='skip',
+                       **xy(mid),
+                       **error),
+            go.Scatter(name='replicated mean',
+                       mode='markers',
+                       marker={'symbol': 'diamond', 'color': 'black'},
+                       **xy(interval['mean']))]
+
+def _is_bootstrap(interval):
+
+    # bootstrap intervals bracket their estimate, replicated ones need not
+    return 'estimate' in interval
+
+def plot_rank_means(ranking_df,
+                    intervals=None):
+
+    index = _as_index(ranking_df)
+
+    plot_df = pd.DataFrame({'choc': index.chocs.astype(str),
+                            'rank': index.mean_rank})
+
+    error_args = {}
+    if intervals is not None and _is_bootstrap(intervals['mean_rank']):
+        plot_df = _error_columns(plot_df, intervals['mean_rank'], 'rank')
+        error_args = {'error_y': 'error_plus', 'error_y_minus': 'error_minus'}
+
+    fig = px.bar(plot_df.sort_values('rank'),
                  x='choc',
                  y='rank',
-                 template='simple_white')
+                 template='simple_white',
+                 **error_args)
+
+    if intervals is not None and not error_args:
+        fig.add_traces(_replicated_traces(plot_df['choc'], intervals['mean_rank']))
 
     fig.update_layout(showlegend=False,
                       yaxis_title='Mean rank')
@@ -16,22 +80,48 @@ def plot_rank_means(ranking_df):
     return fig
 
 def plot_top_bottom_n(ranking_df,
-                        n):
+                        n,
+                        intervals=None):
+
+    # intervals for another n would be drawn against these counts unnoticed
+    if intervals is not None and intervals.get('n') != n:
+        raise ValueError('intervals were computed for n={i}, not n={n}'.format(i=intervals.get('n'), n=n))
+
+    index = _as_index(ranking_df)
 
     top_n = 'top_{n}'.format(n=n)
     bottom_n = 'bottom_{n}'.format(n=n)
 
-    ranking_df[top_n] = ranking_df['rank'] <= n-1
-    ranking_df[bottom_n] = ranking_df['rank'] >= max(ranking_df['rank']) - n
+    frames = []
+    for variable, counts, stat in sorted([(top_n, index.top_n(n), 'top_n'),
+                                          (bottom_n, index.bottom_n(n), 'bottom_n')]):
+        frame = pd.DataFrame({'choc': index.chocs.astype(str),
+                              'variable': variable,
+                              'value': counts})
+        if intervals is not None and _is_bootstrap(intervals[stat]):
+            frame = _error_columns(frame, intervals[stat], 'value')
+        frames.append((stat, frame))
+    plot_df = pd.concat([frame for _, frame in frames])
+
+    error_args = {}
+    if 'error_plus' in plot_df:
+        error_args = {'error_x': 'error_plus', 'error_x_minus': 'error_minus'}
 
-    fig = px.bar(ranking_df[['choc', top_n, bottom_n]].melt(id_vars='choc').groupby(['choc','variable'])['value'].sum().reset_index(),
+    fig = px.bar(plot_df.sort_index(kind='stable'),
        y='choc',
        x='value',
        facet_col='variable',
-       template='simple_white')
+       template='simple_white',
+       **error_args)
+
+    # facets follow the order the variables appear in plot_df
+    if intervals is not None and not error_args:
+        for col, (stat, frame) in enumerate(frames, start=1):
+            for trace in _replicated_traces(frame['choc'], intervals[stat], horizontal=True):
+                fig.add_trace(trace, row=1, col=col)
 
     fig.update_layout(showlegend=False,
                         xaxis_title='frequency',
                         yaxis_title='choc')
 
-    return fig
\ No newline at end of file
+    return fig
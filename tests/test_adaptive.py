@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from src.models.adaptive import AdaptiveSurvey, max_subset_size
+from src.models.serve_model import ScoringService
+
+
+def _posterior(n_draws=100,
+               n_chocs=8,
+               seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    return {'choc_mus_adj': rng.normal(size=(n_draws, n_chocs)),
+            'choc_sigmas_fitted': rng.gamma(5, 0.2, size=(n_draws, n_chocs)),
+            'chocs': np.array(['choc_{i}'.format(i=i) for i in range(n_chocs)])}
+
+
+def test_next_subset_rejects_large_k():
+
+    survey = AdaptiveSurvey(_posterior())
+
+    with pytest.raises(ValueError):
+        survey.next_subset(max_subset_size + 1)
+
+
+def test_next_subset_orders_are_numbered_within_k_factorial():
+
+    survey = AdaptiveSurvey(_posterior())
+    result = survey.next_subset(max_subset_size, answers=[['choc_0', 'choc_1']])
+
+    assert len(set(result['subset'])) == max_subset_size
+    assert 0 <= result['eig'] <= np.log(120)
+
+
+def test_self_pair_answers_are_rejected():
+
+    survey = AdaptiveSurvey(_posterior())
+
+    with pytest.raises(ValueError):
+        survey.weights([['choc_0', 'choc_0']])
+
+
+def test_next_question_rejects_large_k(tmp_path):
+
+    path = str(tmp_path / 'fit.npz')
+    np.savez(path, **_posterior())
+    service = ScoringService({'fit': path})
+
+    status, body = service.query('/next_question', (('k', str(max_subset_size + 1)),))
+    assert status == 400
+    assert 'k must be' in body['error']
+
+    status, body = service.query('/next_question', (('k', '3'),))
+    assert status == 200
+    assert len(body['subset']) == 3
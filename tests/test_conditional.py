@@ -0,0 +1,16 @@
+import numpy as np
+
+from src.models.conditional import ConditionalRanker
+
+
+def test_predict_accepts_comparison_arrays_with_order():
+
+    rng = np.random.default_rng(0)
+    posterior = {'choc_mus_adj': rng.normal(size=(50, 4)),
+                 'choc_sigmas_fitted': np.ones((50, 4)),
+                 'chocs': np.array(['a', 'b', 'c', 'd'])}
+
+    from_array = ConditionalRanker(posterior).predict(np.array([['a', 'b']]), order=['c', 'd'], method='importance')
+    from_list = ConditionalRanker(posterior).predict([('a', 'b')], order=['c', 'd'], method='importance')
+
+    assert np.allclose(from_array['expected_rank'], from_list['expected_rank'])
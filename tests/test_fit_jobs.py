@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import json
+from types import SimpleNamespace
+
+from src.models.fit_jobs import FitJobManager
+from src.models.stan_models import make_stan_data
+
+
+def _args(manager,
+          job_dir,
+          inits,
+          chain=1):
+
+    return manager._chain_args('choc_model', str(job_dir), chain, 100, 100, 1, {'inits': inits})
+
+
+def test_inits_file_is_passed_to_cmdstan(tmp_path):
+
+    init_file = tmp_path / 'inits.json'
+    init_file.write_text('{}')
+    manager = FitJobManager()
+
+    model = SimpleNamespace(stan_file='choc_model.stan')
+    inits = manager._resolve_inits(model, {}, 2, 1, str(init_file))
+
+    assert 'init={f}'.format(f=init_file) in _args(manager, tmp_path, inits)
+
+
+def test_missing_inits_file_is_rejected(tmp_path):
+
+    model = SimpleNamespace(stan_file='choc_model.stan')
+
+    with pytest.raises(ValueError):
+        FitJobManager()._resolve_inits(model, {}, 2, 1, str(tmp_path / 'missing.json'))
+
+
+def test_data_inits_are_written_per_chain(tmp_path):
+
+    rankings = np.array([np.random.default_rng(p).permutation(5) for p in range(6)])
+    data = make_stan_data(rankings)
+    manager = FitJobManager()
+
+    model = SimpleNamespace(stan_file='choc_model_nc.stan')
+    inits = manager._resolve_inits(model, data, 2, 1, 'data')
+    assert len(inits) == 2
+
+    args = _args(manager, tmp_path, inits, chain=2)
+    assert 'init={f}'.format(f=tmp_path / 'inits_2.json') in args
+
+    with open(tmp_path / 'inits_2.json') as f:
+        assert set(json.load(f)) >= {'choc_mus_dir', 'ratings_u'}
@@ -0,0 +1,23 @@
+import pytest
+
+from src.data.make_dataset import validate_rankings, raw_data_to_df
+
+
+def test_validate_rankings_empty_input():
+
+    assert validate_rankings({}) == ({}, [])
+
+
+def test_validate_rankings_all_quarantined():
+
+    valid, quarantined = validate_rankings({'alice': {'ranking': ['']},
+                                            'bob': {'ranking': []}})
+
+    assert valid == {}
+    assert [q['person'] for q in quarantined] == ['alice', 'bob']
+
+
+def test_raw_data_to_df_rejects_empty_input():
+
+    with pytest.raises(ValueError):
+        raw_data_to_df({})
@@ -0,0 +1,81 @@
+import numpy as np
+
+import os
+from types import SimpleNamespace
+
+from src.models.instrumentation import FitRecorder
+from src.models.stan_models import StanModel, method_columns
+
+
+class NoCsvParse():
+
+    def __init__(self,
+                 csv_files,
+                 chains):
+
+        self.runset = SimpleNamespace(csv_files=csv_files)
+        self.chains = chains
+
+    def stan_variable(self,
+                      stan_var):
+
+        raise AssertionError('{var} was parsed from the csvs'.format(var=stan_var))
+
+    def method_variables(self):
+
+        raise AssertionError('method variables were parsed from the csvs')
+
+
+def fake_sample(data,
+                output_dir,
+                chains=2,
+                iter_sampling=20,
+                seed=0,
+                **kwargs):
+
+    # writes csvs laid out as cmdstan writes them, without running a sampler
+    n_people, n_chocs = data['n_people'], data['n_chocs']
+    columns = list(method_columns)
+    for stan_var in ('choc_mus_fitted', 'choc_mus_adj', 'choc_sigmas_fitted'):
+        columns += ['{var}.{i}'.format(var=stan_var, i=i + 1) for i in range(n_chocs)]
+    columns += ['ratings.{p}.{c}'.format(p=p + 1, c=c + 1) for c in range(n_chocs) for p in range(n_people)]
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    csv_files = []
+    for chain in range(1, chains + 1):
+        csv_file = os.path.join(output_dir, 'choc_model-{c}.csv'.format(c=chain))
+        draws = rng.normal(size=(iter_sampling, len(columns)))
+        draws[:, columns.index('treedepth__')] = 3
+        draws[:, columns.index('n_leapfrog__')] = 7
+        draws[:, columns.index('divergent__')] = 0
+
+        with open(csv_file, 'w') as f:
+            f.write('#   num_samples = {n}\n#   id = {c}\n'.format(n=iter_sampling, c=chain))
+            f.write(','.join(columns) + '\n')
+            for row in draws:
+                f.write(','.join(str(value) for value in row) + '\n')
+            f.write('#  Elapsed Time: 0.5 seconds (Warm-up)\n#                0.5 seconds (Sampling)\n')
+        csv_files.append(csv_file)
+
+    return NoCsvParse(csv_files, chains)
+
+
+def test_restricted_draws_vars_keep_fit_stats_streamed(tmp_path):
+
+    model = StanModel.__new__(StanModel)
+    model.filename = 'choc_model.stan'
+    model.compile_stats = FitRecorder()
+    model.src_info = lambda: {}
+    model.sample = fake_sample
+
+    rankings = np.array([np.random.default_rng(p).permutation(4) for p in range(5)])
+    model.fit(rankings,
+              draws_dir=str(tmp_path / 'draws'),
+              draws_vars=['choc_mus_adj'],
+              chains=2)
+
+    assert set(model.fit_stats.ess) == {'choc_mus_fitted', 'choc_sigmas_fitted'}
+    assert model.get_stan_variable('choc_mus_adj').shape == (40, 4)
+    assert not os.path.exists(str(tmp_path / 'draws' / 'ratings'))
@@ -0,0 +1,19 @@
+from src.data import make_dataset
+from src.models import train_model
+
+
+def test_ingest_key_changes_with_segments(tmp_path, monkeypatch):
+
+    (tmp_path / 'alice.txt').write_text('mars\ntwix\n')
+    segments = tmp_path / 'segments.csv'
+    segments.write_text('person,segment\nalice,a\n')
+
+    monkeypatch.setattr(train_model, 'external_data_dir', str(tmp_path))
+    monkeypatch.setattr(make_dataset, 'segments_path', str(segments))
+
+    ingest = train_model.make_pipeline(cache_dir=str(tmp_path / 'cache')).stages['ingest']
+    key = ingest.key([])
+    assert ingest.key([]) == key
+
+    segments.write_text('person,segment\nalice,b\n')
+    assert ingest.key([]) != key